@@ -1,42 +1,103 @@
 #!/usr/bin/python
 
 import numpy as np
-from scipy.signal import medfilt
 import collections
-import wave
-import struct
-from itertools import cycle
-try:
-    from itertools import izip
-except ImportError:  # python3.x
-    izip = zip
-import copy
 import threading
+import framing
+import wavio
+import sources
+import cache
+import baseline
+import instrument
 FFTLEN = 2048
+#Default frame length in samples. Frames do not overlap unless a smaller hop
+#is given.
+FRAME_LEN = 500
+WINDOW = "rect"
+#Noise floor estimator, one of baseline.METHODS
+BASELINE = "median"
+#Memory budget of each of the spectrum, baseline and detection caches
+CACHE_BYTES = 32 * 2**20
+
+
+def channel_names(kinds, nchannels, prefix=""):
+    """ Labels for one channel of each kind per audio channel, grouped by
+        kind, numbered from 1 when there is more than one audio channel """
+    names = []
+    for kind in kinds:
+        for c in range(nchannels):
+            names.append(prefix + kind + (" %d" % (c+1) if nchannels > 1 else ""))
+    return names
+
+
+def _function(method):
+    #Plain function behind a python 2 unbound method
+    return getattr(method, "__func__", method)
 
 
 class ExampleAlg(threading.Thread):
-    def __init__(self, wav_path):
+    #Names of the arrays returned by _alg, detections last
+    OUTPUTS = ("without_peaks", "out")
+
+    def __init__(self, wav_path=None, source=None, frame_len=FRAME_LEN, hop=None,
+                 fftlen=FFTLEN, window=WINDOW, cache_bytes=CACHE_BYTES,
+                 baseline_method=BASELINE, compact=False):
+        """ Analyze the WAV file at wav_path in a loop, or frames from any
+            other source, such as a sources.StreamSource for live input.
+            frame_len, hop, fftlen and window set up the STFT framing. A
+            source passed in brings its own frame_len and hop. Results for
+            repeated frames are cached, up to cache_bytes per cache.
+            baseline_method picks the noise floor estimator. compact runs
+            frames in float32 through a preallocated workspace.Workspace
+            instead, see runCompact(). """
         threading.Thread.__init__(self)
+        if compact and _function(type(self)._alg) is not _function(ExampleAlg._alg):
+            raise ValueError("compact mode only runs ExampleAlg's own detection")
+        self.workspace = None
         try:
-            self.wav = wave.open(wav_path, 'r')
-            self.all_params = self.wav.getparams()
+            if source is None:
+                #Sample data is memory mapped, so only the frames that are
+                #actually processed are ever read from disk
+                source = sources.FileSource(wav_path, frame_len, hop)
+            self.source = source
+            self.frame_len = source.frame_len
+            self.hop = source.hop
+            self.fftlen = fftlen
+            self.framer = framing.Framer(self.frame_len, self.hop, fftlen, window)
+            self.baseline_method = baseline_method
+            #Only file backed sources can be processed in one batch
+            self.wavdata = getattr(source, "samples", None)
+            self.all_params = source.params
             self.nchannels = self.all_params[0]
             self.sampwidth = self.all_params[1]
             self.framerate = self.all_params[2]
             self.nframes = self.all_params[3]
             self.comptype = self.all_params[4]
             self.compname = self.all_params[5]
-            self.fftlen = FFTLEN
 
             print(self.all_params)
-            temp_data = self.wav.readframes(self.nframes)
-            self.wavdata = struct.unpack(str(int(len(temp_data) / self.sampwidth))+"H", temp_data)
+            #Parameters are written by the GUI thread and read by whichever
+            #thread runs the algorithm
+            self.params_lock = threading.Lock()
             self._initAdjustableParams()
-            step = 500
-            s = range(0,self.nframes+step,step)
-            self.data_iter = izip(cycle(s[:-1]), cycle(s[1:]))
-            self.wav.close()
+
+            #Spectra keyed by frame, baselines keyed by frame, estimator and
+            #med_filt_width, and detections keyed by frame and every
+            #parameter value
+            self.frame_id = None
+            self.spectrum_cache = cache.LRUCache(cache_bytes)
+            self.baseline_cache = cache.LRUCache(cache_bytes)
+            self.detection_cache = cache.LRUCache(cache_bytes)
+
+            #Stage timings, off until profiler.enabled is set
+            self.profiler = instrument.Profiler()
+
+            if compact:
+                import workspace
+                self.workspace = workspace.Workspace(
+                    self.nchannels, self.frame_len, fftlen, window,
+                    self.adjustable_params["peak_count"]["max"],
+                    self.adjustable_params["med_filt_width"]["max"]+1)
         except IOError:
             print("Unable to find specified file - make sure to include the full path")
 
@@ -56,72 +117,283 @@ class ExampleAlg(threading.Thread):
         param["current_value"] = val_min
         return param
 
+    def setParam(self, key, value):
+        """ Thread safe update of a single adjustable parameter. Parameters
+            are bin counts and widths, so value is made an int. """
+        with self.params_lock:
+            self.adjustable_params[key]["current_value"] = int(value)
+
+    def getParams(self):
+        """ Consistent snapshot of all current parameter values, by name """
+        with self.params_lock:
+            return dict((k, v["current_value"]) for k, v in self.adjustable_params.items())
+
+    def cacheStats(self):
+        """ Hit/miss counters and sizes of each cache, by name """
+        return {"spectrum": self.spectrum_cache.stats(),
+                "baseline": self.baseline_cache.stats(),
+                "detection": self.detection_cache.stats()}
+
+    def _spectra(self, frames):
+        """ Magnitude spectra of the rows of frames, first fftlen/2 bins. """
+        return self.framer.spectra(frames)
+
+    def channelNames(self):
+        """ Label of each channel of run()'s result """
+        return (channel_names(("spectrum",), self.nchannels) +
+                channel_names(self.OUTPUTS, self.nchannels))
+
     def _channel(self):
-        n = next(self.data_iter)
-        fftlen = self.fftlen
-        return np.asarray(abs(np.fft.fft(self.wavdata[n[0]:n[1]],fftlen))[:fftlen/2])
+        frame = self.source.next_frame()
+        #Live sources give no frame_id, since their frames never repeat
+        self.frame_id = self.source.frame_id
+        if self.frame_id is None:
+            return self._spectra(frame)
+        spectrum = self.spectrum_cache.get(self.frame_id)
+        if spectrum is None:
+            spectrum = self._spectra(frame)
+            self.spectrum_cache.put(self.frame_id, spectrum)
+        return spectrum
 
-    def _alg(self, current_channel):
-        med_filt_width = self.adjustable_params["med_filt_width"]["current_value"]
-        med_filt_width = med_filt_width if med_filt_width % 2 == 1 else med_filt_width+1
-        filtered = np.array(medfilt(current_channel, [med_filt_width]))
-        filtered = np.array(current_channel) - filtered
-        filtered = np.apply_along_axis(abs, 0, filtered)
-        enumerated = list(zip(range(len(filtered)),filtered))
-        fftlen = self.fftlen
-
-        peak_count = self.adjustable_params["peak_count"]["current_value"]
-        peak_width_bins = self.adjustable_params["peak_width_bins"]["current_value"]
-        chan_width_bins = self.adjustable_params["chan_width_bins"]["current_value"]
-        peaks = []
+    def _baseline(self, spectra, med_filt_width, frame_id=None):
+        """ Noise floor of frames x bins spectra, cached by frame_id """
+        floor = None
+        key = (frame_id, self.baseline_method, med_filt_width)
+        if frame_id is not None:
+            floor = self.baseline_cache.get(key)
+        if floor is None:
+            floor = baseline.baseline(spectra, med_filt_width, self.baseline_method)
+            if frame_id is not None:
+                self.baseline_cache.put(key, floor)
+        return floor
+
+    def _suppressPeaks(self, filtered, peak_count, half_width):
+        """ Find the peak_count highest peaks of each row of filtered, zeroing
+            half_width bins either side of each in place. Returns the
+            frames x peak_count peak bins in the order they were found. """
+        nrows, nbins = filtered.shape
+        bins = np.arange(nbins)
+
+        #Masked argmax - zero out the neighborhood of each peak in place so the
+        #next argmax finds the next highest peak
+        peaks = np.empty((nrows, peak_count), dtype=np.intp)
         for i in range(peak_count):
-            peak_bin = max(enumerated, key=lambda tup: tup[1])[0]
-            peaks.append(peak_bin)
-            lo = peak_bin-peak_width_bins/2 if peak_bin-peak_width_bins/2 >= 0 else 0
-            hi = peak_bin+peak_width_bins/2 if peak_bin-peak_width_bins/2 < len(enumerated) else len(enumerated)
-            enumerated = copy.deepcopy([(x,y) if x < lo or x > hi else (x,0) for x,y in enumerated])
-
-        without_peaks = np.array([tup[1] for tup in enumerated])
-        chan_stats = {}
-        for peak in peaks:
-            chan = without_peaks[peak+peak_width_bins/2:peak+chan_width_bins-peak_width_bins/2]
-            if len(chan) < 2:
-                #Supress barfing for small channel len() == 0
-                continue
-            chan_stats[peak] = {}
-            chan_stats[peak]["mean"] = np.mean(chan)
-            chan_stats[peak]["var"] = np.var(chan)
-            zeroed = np.where(chan == 0)
-            chan[zeroed] = 1E5
-            local_min = 0
-            temp = max(chan)
-            for i, value in enumerate(chan):
-                local_min, temp = (i, value) if value < temp and i > 0 else (local_min, temp)
-            chan_stats[peak]["chan_min"] = int(peak+local_min)
-
-        out = [0]*len(current_channel)
-        lo = self.adjustable_params["passband_start_bin"]["current_value"]
-        hi = self.adjustable_params["passband_stop_bin"]["current_value"]
-        for k in chan_stats.keys():
-            idx = chan_stats[k]["chan_min"]
-            if idx > lo and idx < hi:
-                out[idx] = 1E7
-        return without_peaks, out
+            peak_bin = np.argmax(filtered, axis=1)
+            peaks[:, i] = peak_bin
+            filtered[np.abs(bins - peak_bin[:, None]) <= half_width] = 0
+        return peaks
+
+    def _channelStats(self, without_peaks, peaks, half_width, chan_width_bins):
+        """ Find the quietest bin of the channel after each peak, and the
+            mean and variance of the channel. Zero bins of each channel are
+            filled in place. Returns the frames x peaks chan_min bins, a mask
+            of which of them are valid, and the means and variances. """
+        nrows, nbins = without_peaks.shape
+        peak_count = peaks.shape[1]
+        rows = np.arange(nrows)
+        bins = np.arange(nbins)
+
+        #Channel statistics are taken peak by peak, in order, since each
+        #channel's zero fill is visible to the channels after it
+        chan_min = np.empty((nrows, peak_count), dtype=np.intp)
+        valid = np.empty((nrows, peak_count), dtype=bool)
+        chan_mean = np.empty((nrows, peak_count))
+        chan_var = np.empty((nrows, peak_count))
+        for i in range(peak_count):
+            peak_bin = peaks[:, i]
+            lo = np.minimum(peak_bin+half_width, nbins)
+            #Channel bounds follow python slicing, so a negative stop counts
+            #back from the end of the spectrum
+            hi = peak_bin+chan_width_bins-half_width
+            hi = np.clip(np.where(hi < 0, hi+nbins, hi), 0, nbins)
+            #Supress barfing for small channel len() == 0
+            valid[:, i] = hi - lo >= 2
+            chan = (bins >= lo[:, None]) & (bins < hi[:, None]) & valid[:, i, None]
+
+            #Mean and variance are of the channel before its zero fill
+            width = np.maximum(hi - lo, 1)
+            chan_mean[:, i] = np.where(chan, without_peaks, 0).sum(axis=1) / width
+            dev = np.where(chan, without_peaks - chan_mean[:, i, None], 0)
+            chan_var[:, i] = (dev**2).sum(axis=1) / width
+            without_peaks[chan & (without_peaks == 0)] = 1E5
+
+            #Lowest bin after the first one, falling back to the first bin when
+            #nothing is strictly below the channel maximum
+            after_first = np.where(chan & (bins > lo[:, None]), without_peaks, np.inf)
+            local_min = np.argmin(after_first, axis=1)
+            chan_max = np.where(chan, without_peaks, -np.inf).max(axis=1)
+            local_min = np.where(after_first[rows, local_min] < chan_max, local_min, lo)
+            chan_min[:, i] = peak_bin + local_min - lo
+
+        #A peak found more than once only keeps the statistics of its last
+        #channel
+        for i in range(peak_count-1):
+            valid[:, i] &= ~(peaks[:, i+1:] == peaks[:, i, None]).any(axis=1)
+        return chan_min, valid, chan_mean, chan_var
+
+    def _alg(self, current_channel, frame_id=None, params=None):
+        """ Run detection on a single spectrum, or on every row of a
+            frames x bins matrix at once. Returns without_peaks and out with
+            the same shape as current_channel. Passing the frame_id of a
+            single spectrum lets its baseline be cached. """
+        current_channel = np.asarray(current_channel)
+        res = self._detect(current_channel, frame_id, params)
+        return (res["without_peaks"].reshape(current_channel.shape),
+                res["out"].reshape(current_channel.shape))
+
+    def _detect(self, current_channel, frame_id=None, params=None, floor=None):
+        """ Detection with every intermediate result, by name, each with one
+            row per spectrum: without_peaks and out, and per peak the peak
+            bin, chan_min bin, whether it is valid and detected (valid and
+            inside the passband), and the channel mean and variance. floor,
+            if given, is used as the baseline of current_channel. """
+        spectra = np.atleast_2d(np.asarray(current_channel, dtype=np.float64))
+        nrows, nbins = spectra.shape
+
+        params = self.getParams() if params is None else params
+        med_filt_width = params["med_filt_width"]
+        med_filt_width = med_filt_width if med_filt_width % 2 == 1 else med_filt_width+1
+        profiler = self.profiler
+        with profiler.stage("baseline"):
+            if floor is None:
+                floor = self._baseline(spectra, med_filt_width, frame_id)
+            filtered = np.abs(spectra - floor)
+
+        half_width = params["peak_width_bins"] // 2
+        with profiler.stage("peaks"):
+            peaks = self._suppressPeaks(filtered, params["peak_count"], half_width)
+        without_peaks = filtered
+        with profiler.stage("chan_stats"):
+            chan_min, valid, chan_mean, chan_var = self._channelStats(
+                without_peaks, peaks, half_width, params["chan_width_bins"])
+
+        out = np.zeros((nrows, nbins))
+        lo = params["passband_start_bin"]
+        hi = params["passband_stop_bin"]
+        hit = valid & (chan_min > lo) & (chan_min < hi)
+        out[np.nonzero(hit)[0], chan_min[hit]] = 1E7
+
+        res = collections.OrderedDict()
+        res["without_peaks"] = without_peaks
+        res["out"] = out
+        res["peaks"] = peaks
+        res["chan_min"] = chan_min
+        res["valid"] = valid
+        res["detected"] = hit
+        res["chan_mean"] = chan_mean
+        res["chan_var"] = chan_var
+        return res
+
+    def frameCount(self):
+        """ Number of frames in the recording, counting a partial last frame """
+        return self.framer.frame_count(self.nframes)
+
+    def spectraRange(self, start, stop):
+        """ Spectra of frames start to stop of the recording as one
+            frames x channels rows by bins matrix. Only the samples of those
+            frames are read from the file, and partial frames at the end are
+            zero padded. """
+        hop = self.hop
+        first = start*hop
+        needed = (stop-start-1)*hop + self.frame_len
+        samples = self.wavdata[:, first:min(first+needed, self.nframes)]
+        samples = wavio.scale(samples, self.sampwidth)
+        if samples.shape[1] < needed:
+            samples = np.pad(samples, ((0, 0), (0, needed-samples.shape[1])), "constant")
+        #One FFT over every channel of every frame
+        spectra = self._spectra(self.framer.frames(samples)).transpose(1, 0, 2)
+        return spectra.reshape(-1, self.fftlen//2)
+
+    def batch(self, frames_per_chunk=256, start=0, stop=None, details=False):
+        """ Run the whole recording, or frames start to stop of it, through
+            the algorithm in one pass, instead of one frame per call to
+            run(). Frames follow the same framing as run(), with partial
+            frames at the end zero padded. Returns a table of per-frame
+            results, one row per frame. Multichannel recordings get a
+            channels axis after the frames axis. With details, the per peak
+            results of _detect are included too. """
+        if self.wavdata is None:
+            raise ValueError("batch() needs a file backed source")
+        hop = self.hop
+        nbins = self.fftlen//2
+        nchannels = self.nchannels
+        stop = self.frameCount() if stop is None else min(stop, self.frameCount())
+        nframes = max(stop - start, 0)
+        #One parameter snapshot for the whole run
+        params = self.getParams()
+        shape = (nframes,) + ((nchannels,) if nchannels > 1 else ()) + (nbins,)
+        table = collections.OrderedDict()
+        table["frame_start"] = np.arange(start, start+nframes) * hop
+        table["spectrum"] = np.empty(shape)
+        table["without_peaks"] = np.empty(shape)
+        table["out"] = np.empty(shape)
+        if details:
+            peak_shape = shape[:-1] + (params["peak_count"],)
+            for name, dtype in (("peaks", np.intp), ("chan_min", np.intp), ("valid", bool),
+                                ("detected", bool), ("chan_mean", np.float64),
+                                ("chan_var", np.float64)):
+                table[name] = np.empty(peak_shape, dtype=dtype)
+        for i in range(0, nframes, frames_per_chunk):
+            j = min(i+frames_per_chunk, nframes)
+            #Every channel of every frame in one _alg pass
+            spectra = self.spectraRange(start+i, start+j)
+            table["spectrum"][i:j] = spectra.reshape((j-i,) + shape[1:])
+            if details:
+                res = self._detect(spectra, None, params)
+            else:
+                res = dict(zip(("without_peaks", "out"), self._alg(spectra, None, params)))
+            for name, column in res.items():
+                table[name][i:j] = column.reshape((j-i,) + table[name].shape[1:])
+        return table
+
+    def process(self, spectrum, frame_id=None):
+        """ Run detection on one spectrum from the front end. Returns the
+            list of output channels, without the spectrum itself. """
+        #Detections depend on the frame and on every parameter value
+        params = self.getParams()
+        res = None
+        if frame_id is not None:
+            key = (frame_id,) + tuple(sorted(params.items()))
+            res = self.detection_cache.get(key)
+        if res is None:
+            res = self._alg(spectrum, frame_id, params)
+            if frame_id is not None:
+                self.detection_cache.put(key, res)
+        #One channel per output and audio channel, grouped by output
+        res = np.asarray(res)
+        return list(res.reshape(-1, res.shape[-1]))
+
+    def runCompact(self):
+        """ Process the next frame in the preallocated float32 workspace,
+            without the caches. Returns the frame's structured result, see
+            workspace.result_dtype, which is overwritten once
+            workspace.SLOTS more frames have been processed. """
+        ws = self.workspace
+        source = self.source
+        with self.profiler.stage("fft"):
+            #File sources hand over unscaled samples straight from the file
+            next_samples = getattr(source, "next_samples", None)
+            samples = source.next_frame() if next_samples is None else next_samples()
+            self.frame_id = source.frame_id
+            ws.spectra(samples, self.sampwidth, self.frame_id)
+        res = ws.detect(self.getParams(), self.baseline_method, self.profiler)
+        self.profiler.end_frame()
+        return res
 
     def run(self):
+        if self.workspace is not None:
+            self.runCompact()
+            return self.workspace.channels()
         out = []
 
-        chan = np.asarray(self._channel())
+        with self.profiler.stage("fft"):
+            chan = np.asarray(self._channel())
         if len(np.shape(chan)) > 1:
             for i in range(np.shape(chan)[0]):
                 out.append(chan[i])
         else:
             out.append(chan)
 
-        res = np.asarray(self._alg(chan))
-        if len(np.shape(res)) > 1:
-            for i in range(np.shape(res)[0]):
-                out.append(res[i])
-        else:
-            out.append(res)
+        out.extend(self.process(chan, self.frame_id))
+        self.profiler.end_frame()
         return out
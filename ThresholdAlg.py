@@ -0,0 +1,42 @@
+#!/usr/bin/python
+
+import numpy as np
+import collections
+import ExampleAlg
+
+
+class ThresholdAlg(ExampleAlg.ExampleAlg):
+    """ Detects every bin standing more than threshold_db above the noise
+        floor inside the passband, instead of a fixed number of peaks.
+        Shares framing, caching and batching with ExampleAlg. """
+    OUTPUTS = ("above_floor", "out")
+
+    def _initAdjustableParams(self):
+        self.adjustable_params = collections.OrderedDict()
+        #The floor has to be wider than a peak, or it follows the peaks up
+        self.adjustable_params["med_filt_width"] = self._setSingleParam(15,90)
+        self.adjustable_params["threshold_db"] = self._setSingleParam(6,40)
+        self.adjustable_params["passband_start_bin"] = self._setSingleParam(20, 500)
+        self.adjustable_params["passband_stop_bin"] = self._setSingleParam(250, 950)
+
+    def _alg(self, current_channel, frame_id=None, params=None):
+        """ Returns the spectrum above the noise floor, and the detections,
+            with the same shape as current_channel """
+        current_channel = np.asarray(current_channel, dtype=np.float64)
+        spectra = np.atleast_2d(current_channel)
+        nrows, nbins = spectra.shape
+
+        params = self.getParams() if params is None else params
+        med_filt_width = params["med_filt_width"]
+        med_filt_width = med_filt_width if med_filt_width % 2 == 1 else med_filt_width+1
+        with self.profiler.stage("baseline"):
+            floor = self._baseline(spectra, med_filt_width, frame_id)
+        above = np.maximum(spectra - floor, 0)
+
+        #Compare magnitudes, floor*10**(dB/20) avoids a log per bin
+        with self.profiler.stage("threshold"):
+            hit = spectra > floor * 10**(params["threshold_db"]/20.)
+            hit[:, :params["passband_start_bin"]+1] = False
+            hit[:, params["passband_stop_bin"]:] = False
+        out = np.where(hit, 1E7, 0.)
+        return above.reshape(current_channel.shape), out.reshape(current_channel.shape)
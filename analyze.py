@@ -0,0 +1,150 @@
+#!/usr/bin/python
+""" Headless batch analysis of WAV files with ExampleAlg.
+
+    python analyze.py -o results -j 8 recordings/ other.wav
+
+Every file is split into ranges of frames which are spread across a pool of
+processes. Workers memory map the input, so each one only reads the frames
+it processes. Results are written as one compressed .npz file per input,
+holding the (frame, channel, bin) index of every detection, and optionally
+the spectrum of every frame as float32.
+"""
+
+import argparse
+import collections
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import ExampleAlg
+import baseline
+import framing
+import wavio
+
+
+def analyze_range(wav_path, start, stop, params, keep_spectra=False, framing_args={}):
+    """ Run frames start to stop of wav_path with the given parameter values,
+        returning only the detections (and spectra, if asked for).
+        framing_args go to the ExampleAlg constructor. """
+    alg = ExampleAlg.ExampleAlg(wav_path, **framing_args)
+    for key, value in params.items():
+        alg.setParam(key, value)
+    table = alg.batch(start=start, stop=stop)
+    out = table["out"]
+    if out.ndim == 2:
+        out = out[:, None]
+    frame, channel, bins = np.nonzero(out)
+    res = {"frame": (frame + start).astype(np.int32),
+           "channel": channel.astype(np.int32),
+           "bin": bins.astype(np.int32)}
+    if keep_spectra:
+        res["spectrum"] = table["spectrum"].astype(np.float32)
+    return res
+
+def find_wavs(paths):
+    """ Expand directories in paths to the WAV files found under them """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(".wav"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def save_results(out_path, wav_path, params, parts, keep_spectra):
+    """ Join the ranges of one file in frame order and write them to disk """
+    parts = [parts[k] for k in sorted(parts)]
+    res = {"frame": np.concatenate([p["frame"] for p in parts]),
+           "channel": np.concatenate([p["channel"] for p in parts]),
+           "bin": np.concatenate([p["bin"] for p in parts]),
+           "source": np.array(os.path.abspath(wav_path)),
+           "param_names": np.array(list(params.keys())),
+           "param_values": np.array(list(params.values()), dtype=np.int32)}
+    if keep_spectra:
+        res["spectrum"] = np.concatenate([p["spectrum"] for p in parts])
+    np.savez_compressed(out_path, **res)
+
+def parse_params(pairs):
+    """ Turn a list of NAME=VALUE strings into an ordered dict of ints """
+    params = collections.OrderedDict()
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        params[key] = int(value)
+    return params
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run ExampleAlg over WAV files without the GUI")
+    parser.add_argument("paths", nargs="+", help="WAV files, or directories to search for them")
+    parser.add_argument("-o", "--outdir", default=".", help="directory for the .npz results")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, default one per core")
+    parser.add_argument("--frames", type=int, default=4096, help="frames per task")
+    parser.add_argument("--frame-len", type=int, default=ExampleAlg.FRAME_LEN, help="samples per frame")
+    parser.add_argument("--hop", type=int, default=None, help="samples between frame starts, default frame-len")
+    parser.add_argument("--fftlen", type=int, default=ExampleAlg.FFTLEN, help="FFT length")
+    parser.add_argument("--window", default=ExampleAlg.WINDOW, choices=sorted(framing.WINDOWS),
+                        help="window function")
+    parser.add_argument("--baseline", default=ExampleAlg.BASELINE, choices=sorted(baseline.METHODS),
+                        help="noise floor estimator")
+    parser.add_argument("--spectra", action="store_true", help="also store every spectrum as float32")
+    parser.add_argument("-p", "--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="set one of ExampleAlg's adjustable_params")
+    args = parser.parse_args(argv)
+    params = parse_params(args.param)
+    framing_args = {"frame_len": args.frame_len, "hop": args.hop,
+                    "fftlen": args.fftlen, "window": args.window,
+                    "baseline_method": args.baseline}
+    framer = framing.Framer(args.frame_len, args.hop)
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    #Files that could not be read or analyzed, with the reason. The rest
+    #are still written.
+    failed = collections.OrderedDict()
+    with ProcessPoolExecutor(args.jobs) as pool:
+        pending = {}
+        parts = collections.defaultdict(dict)
+        for wav_path in find_wavs(args.paths):
+            try:
+                nframes = framer.frame_count(wavio.read_wav(wav_path)[0].nframes)
+            except (IOError, OSError, ValueError) as e:
+                failed[wav_path] = str(e)
+                sys.stderr.write("Skipping " + wav_path + " - " + str(e) + "\n")
+                continue
+            #Files with no frames still get one, empty, task and result
+            for start in range(0, max(nframes, 1), args.frames):
+                stop = min(start+args.frames, nframes)
+                fut = pool.submit(analyze_range, wav_path, start, stop, params,
+                                  args.spectra, framing_args)
+                pending[fut] = (wav_path, start)
+        remaining = collections.Counter(wav_path for wav_path, _ in pending.values())
+
+        for fut in as_completed(pending):
+            wav_path, start = pending[fut]
+            if wav_path in failed:
+                continue
+            try:
+                parts[wav_path][start] = fut.result()
+            except Exception as e:
+                failed[wav_path] = str(e)
+                parts.pop(wav_path, None)
+                sys.stderr.write("Failed " + wav_path + " - " + str(e) + "\n")
+                continue
+            remaining[wav_path] -= 1
+            if remaining[wav_path] == 0:
+                #Write each file as soon as all of its ranges are done
+                out_path = os.path.join(args.outdir, os.path.basename(wav_path) + ".npz")
+                save_results(out_path, wav_path, params, parts.pop(wav_path), args.spectra)
+                print(out_path)
+
+    if failed:
+        sys.stderr.write("%d file(s) failed:\n" % len(failed))
+        for wav_path, reason in failed.items():
+            sys.stderr.write("  " + wav_path + " - " + reason + "\n")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
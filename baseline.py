@@ -0,0 +1,81 @@
+#!/usr/bin/python
+""" Noise floor (baseline) estimates for rows of spectra.
+
+Every estimator works along the last axis of a single spectrum or of a
+frames x bins matrix, with a window of width bins centered on each bin and
+zeros past either end, the same edge handling as scipy.signal.medfilt.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+try:
+    #Double heap running median, O(log width) per bin
+    import bottleneck
+except ImportError:
+    bottleneck = None
+
+#Upper bound on elements in the windows x width temporary used by the
+#partition based running median
+PARTITION_BLOCK = 4 * 2**20
+
+
+def _padded(spectra, width):
+    spectra = np.atleast_2d(np.asarray(spectra, dtype=np.float64))
+    half = width // 2
+    return np.pad(spectra, ((0, 0), (half, half)), "constant"), half
+
+def _median_partition(spectra, width):
+    """ Running median by partial sort of every window, a block of rows at a
+        time so the windows temporary stays bounded """
+    padded, half = _padded(spectra, width)
+    nrows, nbins = padded.shape[0], padded.shape[1] - 2*half
+    out = np.empty((nrows, nbins))
+    rows_per_block = max(1, PARTITION_BLOCK // max(1, nbins*width))
+    s0, s1 = padded.strides
+    for i in range(0, nrows, rows_per_block):
+        block = padded[i:i+rows_per_block]
+        windows = as_strided(block, shape=(len(block), nbins, width),
+                             strides=(s0, s1, s1), writeable=False)
+        out[i:i+rows_per_block] = np.partition(windows, half, axis=-1)[..., half]
+    return out
+
+def running_median(spectra, width):
+    """ Median of each width wide window, width odd. Matches
+        scipy.signal.medfilt(spectra, [1, width]) row by row. """
+    shape = np.shape(spectra)
+    if width <= 1:
+        return np.array(spectra, dtype=np.float64)
+    if bottleneck is not None:
+        padded, half = _padded(spectra, width)
+        #move_median windows end at each bin, so drop the first 2*half
+        out = bottleneck.move_median(padded, width, axis=-1)[:, 2*half:]
+    else:
+        out = _median_partition(spectra, width)
+    return out.reshape(shape)
+
+def min_baseline(spectra, width):
+    """ Minimum of each window. Runs in constant time per bin whatever the
+        width, for very wide kernels. """
+    from scipy import ndimage
+    spectra = np.asarray(spectra, dtype=np.float64)
+    return ndimage.minimum_filter1d(spectra, width, axis=-1, mode="constant", cval=0)
+
+def percentile_baseline(spectra, width, percentile=25):
+    """ Given percentile of each window. Low percentiles follow the noise
+        floor under dense peaks better than the median. """
+    from scipy import ndimage
+    spectra = np.asarray(spectra, dtype=np.float64)
+    size = [1] * (spectra.ndim-1) + [width]
+    return ndimage.percentile_filter(spectra, percentile, size=size, mode="constant", cval=0)
+
+METHODS = {"median": running_median,
+           "min": min_baseline,
+           "percentile": percentile_baseline}
+
+def baseline(spectra, width, method="median"):
+    """ Baseline of spectra using one of METHODS """
+    try:
+        fn = METHODS[method]
+    except KeyError:
+        raise ValueError("Unknown baseline " + str(method) + ", expected one of " + ", ".join(sorted(METHODS)))
+    return fn(spectra, width)
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+""" Benchmarks for the ExampleAlg pipeline and the plot render path.
+
+    python benchmark.py -o results.json
+    python benchmark.py -o new.json --compare results.json
+
+Synthetic WAV files of several lengths, sample widths and numbers of tones
+are generated in a temporary directory. Each pipeline stage - WAV loading,
+framing/FFT, baseline filtering, peak picking and channel statistics - is
+timed over every frame of every file for a few settings of
+adjustable_params, and so is the frame by frame loop of run(), in both the
+default and the compact float32 mode, with the memory each frame allocates.
+The spectrum plot is rendered offscreen with Agg, both by full redraws and
+by blitting. Startup is timed as a fresh interpreter getting from imports
+to the first frame. Results are written as JSON with throughput in
+frames/sec and peak traced memory. With --compare, throughput is checked
+against an earlier run and the exit status is nonzero if any benchmark got
+slower by more than the tolerance. Runs headless, no Qt or display needed.
+"""
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+try:
+    import tracemalloc
+except ImportError:  # python2.x
+    tracemalloc = None
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+import ExampleAlg
+import plotcanvas
+import wavio
+
+FRAMERATE = 20000
+SECONDS = (10, 60)
+SAMPWIDTHS = (1, 2, 3, 4)
+TONES = (1, 16, 64)
+REPEAT = 3
+RENDER_FRAMES = 20
+#Frames run one at a time by run() per benchmark of the frame loop
+FRAME_LOOP_FRAMES = 200
+#Monotonic, high resolution clock for timings, as in instrument
+_clock = getattr(time, "perf_counter", time.time)  # python2.x has no perf_counter
+
+#adjustable_params settings to benchmark, from the cheapest to the most
+#expensive detection settings
+PARAM_SETS = collections.OrderedDict()
+PARAM_SETS["min"] = {"med_filt_width": 1, "peak_count": 1, "peak_width_bins": 1,
+                     "chan_width_bins": 1, "passband_start_bin": 20, "passband_stop_bin": 250}
+PARAM_SETS["mid"] = {"med_filt_width": 15, "peak_count": 8, "peak_width_bins": 30,
+                     "chan_width_bins": 120, "passband_start_bin": 100, "passband_stop_bin": 600}
+PARAM_SETS["max"] = {"med_filt_width": 30, "peak_count": 15, "peak_width_bins": 60,
+                     "chan_width_bins": 240, "passband_start_bin": 500, "passband_stop_bin": 950}
+
+
+class AggCanvas(plotcanvas.PlotMixin, FigureCanvasAgg):
+    """ The GUI's spectrum plot drawn onto an offscreen Agg canvas """
+    def __init__(self, use_blit, width=10, height=10, dpi=100):
+        self.fig = Figure(figsize=(width, height), dpi=dpi, facecolor='w')
+        self.axes = self.fig.add_subplot(1,1,1)
+        self.init_plot_state()
+        FigureCanvasAgg.__init__(self, self.fig)
+        self.use_blit = use_blit
+        if use_blit:
+            self.mpl_connect("draw_event", self.cache_background)
+
+
+def make_wav(path, seconds, sampwidth, tones, seed=0):
+    """ Write a mono WAV of tones random sine waves plus noise, at 90% of
+        full scale for sampwidth """
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds*FRAMERATE)) / float(FRAMERATE)
+    data = rng.normal(0, .1, len(t))
+    for freq in rng.uniform(100, FRAMERATE/2.-100, tones):
+        data += np.sin(2*np.pi*freq*t + rng.uniform(0, 2*np.pi))
+    data *= .9 / np.abs(data).max()
+    full_scale = 2**(8*sampwidth-1) - 1
+    ints = np.round(data * full_scale).astype(np.int64)
+    if sampwidth == 1:
+        raw = (ints + 128).astype(np.uint8).tobytes()
+    elif sampwidth == 3:
+        raw = ints.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    else:
+        raw = ints.astype("<i%d" % sampwidth).tobytes()
+    w = wave.open(path, "wb")
+    w.setnchannels(1)
+    w.setsampwidth(sampwidth)
+    w.setframerate(FRAMERATE)
+    w.writeframes(raw)
+    w.close()
+
+def measure(fn, repeat=REPEAT):
+    """ Best wall time of repeat calls to fn, and the peak memory traced
+        during one more call """
+    best = None
+    for i in range(repeat):
+        start = _clock()
+        fn()
+        elapsed = _clock() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+def describe(res):
+    """ Parameter set and render mode of a result, for printing """
+    return "/".join(res[k] for k in ("params", "mode") if k in res)
+
+def record(results, name, frames, fn, **labels):
+    """ Time fn, which processes frames frames, and add it to results """
+    seconds, peak = measure(fn)
+    res = collections.OrderedDict(name=name)
+    res.update(sorted(labels.items()))
+    res["frames"] = frames
+    res["seconds"] = seconds
+    res["fps"] = frames / seconds if seconds > 0 else float("inf")
+    res["peak_bytes"] = peak
+    results.append(res)
+    print("%-16s %-28s %-10s %12.1f frames/s" % (name, labels.get("file", ""),
+                                                 describe(res), res["fps"]))
+
+def bench_pipeline(results, path):
+    """ Time each stage of the algorithm over every frame of path """
+    name = os.path.basename(path)
+    alg = ExampleAlg.ExampleAlg(path)
+    nframes = alg.frameCount()
+
+    def load():
+        params, samples = wavio.read_wav(path)
+        return np.asarray(samples[:]).sum()
+    record(results, "wav_load", nframes, load, file=name)
+
+    samples = wavio.scale(alg.wavdata[0], alg.sampwidth)
+    #Same framing as batch(), with the partial frames at the end zero padded
+    needed = (nframes-1)*alg.hop + alg.frame_len
+    frames = alg.framer.frames(np.pad(samples, (0, max(0, needed-len(samples))), "constant"))
+    record(results, "fft", nframes, lambda: alg._spectra(frames), file=name)
+    spectra = alg._spectra(frames)
+
+    for label, params in PARAM_SETS.items():
+        width = params["med_filt_width"] | 1
+        half_width = params["peak_width_bins"] // 2
+        record(results, "baseline", nframes,
+               lambda: alg._baseline(spectra, width), file=name, params=label)
+        filtered = np.abs(spectra - alg._baseline(spectra, width))
+        record(results, "peak_picking", nframes,
+               lambda: alg._suppressPeaks(filtered.copy(), params["peak_count"], half_width),
+               file=name, params=label)
+        without_peaks = filtered.copy()
+        peaks = alg._suppressPeaks(without_peaks, params["peak_count"], half_width)
+        record(results, "channel_stats", nframes,
+               lambda: alg._channelStats(without_peaks.copy(), peaks, half_width, params["chan_width_bins"]),
+               file=name, params=label)
+        for key, value in params.items():
+            alg.setParam(key, value)
+        record(results, "batch", nframes, alg.batch, file=name, params=label)
+    return alg
+
+def bench_startup(results, path):
+    """ Time a fresh interpreter importing the algorithm host, opening path
+        and computing the first frame, which is the work the GUI waits on
+        before its first plot """
+    name = os.path.basename(path)
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = "import host; host.AlgHost(%r).run()" % path
+    def start():
+        subprocess.check_call([sys.executable, "-c", code], cwd=here,
+                              stdout=subprocess.PIPE)
+    record(results, "startup", 1, start, file=name)
+
+def frame_allocations(alg, frames):
+    """ Median over frames calls to alg.run() of the most memory traced
+        above what was held before the call, the transient allocations of
+        one frame """
+    if tracemalloc is None or not hasattr(tracemalloc, "reset_peak"):
+        return None
+    sizes = []
+    tracemalloc.start()
+    for i in range(frames):
+        tracemalloc.reset_peak()
+        held = tracemalloc.get_traced_memory()[0]
+        alg.run()
+        sizes.append(tracemalloc.get_traced_memory()[1] - held)
+    tracemalloc.stop()
+    return int(np.median(sizes))
+
+def bench_frame_loop(results, path):
+    """ Time run() frame by frame, as the GUI calls it, in the default
+        float64 mode and in the preallocated float32 compact mode, with the
+        memory each frame allocates """
+    name = os.path.basename(path)
+    for mode in ("float64", "compact"):
+        for label, params in PARAM_SETS.items():
+            alg = ExampleAlg.ExampleAlg(path, compact=mode == "compact")
+            for key, value in params.items():
+                alg.setParam(key, value)
+            #Stay clear of the caches, which would hit once the file loops
+            alg.detection_cache.max_bytes = 0
+            alg.spectrum_cache.max_bytes = 0
+            alg.baseline_cache.max_bytes = 0
+            def loop():
+                for i in range(FRAME_LOOP_FRAMES):
+                    alg.run()
+            record(results, "frame_loop", FRAME_LOOP_FRAMES, loop, file=name,
+                   params=label, mode=mode)
+            results[-1]["frame_alloc_bytes"] = frame_allocations(alg, FRAME_LOOP_FRAMES)
+
+def bench_render(results, alg, name):
+    """ Time offscreen drawing of RENDER_FRAMES results, by full redraw and
+        by blitting, for each parameter set """
+    for label, params in PARAM_SETS.items():
+        for key, value in params.items():
+            alg.setParam(key, value)
+        data = [alg.run() for i in range(RENDER_FRAMES)]
+        for mode in ("full", "blit"):
+            canvas = AggCanvas(mode == "blit")
+            canvas.num_chans = len(data[0])
+            canvas.display_chans = [True] * canvas.num_chans
+            canvas.x_max = max(map(len, data[0]))
+            canvas.y_max = 1.05*max(max(ch[1:]) for ch in data[0])
+            canvas.zoom["x"] = [0, canvas.x_max]
+            canvas.zoom["y"] = [0, canvas.y_max]
+            def render():
+                for res in data:
+                    canvas.draw_figure(res)
+            record(results, "render", RENDER_FRAMES, render, file=name, params=label, mode=mode)
+
+def key_of(res):
+    return tuple((k, v) for k, v in res.items()
+                 if k not in ("frames", "seconds", "fps", "peak_bytes", "frame_alloc_bytes"))
+
+def compare(results, baseline_path, tolerance):
+    """ Print throughput relative to an earlier run. Returns the number of
+        benchmarks slower than allowed by tolerance. """
+    with open(baseline_path) as f:
+        old = dict((key_of(res), res) for res in json.load(f)["results"])
+    regressions = 0
+    print("\nCompared with " + baseline_path)
+    for res in results:
+        prev = old.get(key_of(res))
+        if prev is None:
+            continue
+        ratio = res["fps"] / prev["fps"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("%-16s %-28s %-10s %6.2fx%s" % (res["name"], res.get("file", ""),
+                                               describe(res), ratio, flag))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ExampleAlg pipeline and plot rendering")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--compare", metavar="JSON", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=.1,
+                        help="allowed fractional loss of throughput before flagging a regression")
+    parser.add_argument("--quick", action="store_true", help="one short 16 bit file only")
+    args = parser.parse_args(argv)
+
+    seconds = SECONDS[:1] if args.quick else SECONDS
+    sampwidths = (2,) if args.quick else SAMPWIDTHS
+    tones = TONES[1:2] if args.quick else TONES
+
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for secs in seconds:
+            for sampwidth in sampwidths:
+                for ntones in tones:
+                    name = "%ds_%dbit_%dtones.wav" % (secs, 8*sampwidth, ntones)
+                    path = os.path.join(tmpdir, name)
+                    make_wav(path, secs, sampwidth, ntones)
+                    alg = bench_pipeline(results, path)
+                    bench_frame_loop(results, path)
+                    #Rendering and startup do not depend on the sample format
+                    if sampwidth == sampwidths[0] and ntones == tones[0]:
+                        bench_render(results, alg, name)
+                        bench_startup(results, path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    meta = collections.OrderedDict()
+    meta["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    meta["python"] = platform.python_version()
+    meta["numpy"] = np.__version__
+    meta["matplotlib"] = matplotlib.__version__
+    meta["platform"] = platform.platform()
+    if resource is not None:
+        meta["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=1)
+    print("Wrote " + args.output)
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
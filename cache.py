@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+import collections
+import threading
+import numpy as np
+
+
+def nbytes(value):
+    """ Memory held by an array, or a tuple/list of arrays """
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    return getattr(value, "nbytes", 0)
+
+
+class LRUCache(object):
+    """ Least recently used cache bounded by the total size of its values in
+        bytes rather than by entry count. Values are returned as stored, so
+        cached arrays are made read only. """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """ Return the value for key and mark it as recently used, or None """
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Store value, evicting least recently used entries until the cache
+            fits its budget. Values bigger than the whole budget are not
+            stored. """
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+        for arr in (value if isinstance(value, (tuple, list)) else (value,)):
+            if isinstance(arr, np.ndarray):
+                arr.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= nbytes(self.entries.pop(key))
+            self.entries[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.nbytes -= nbytes(old)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """ Counters and current size, by name """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self.entries),
+                    "nbytes": self.nbytes}
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+""" Reduce channels to what can actually be seen before plotting them.
+
+A channel is cut to the visible bin range and split into one bucket per
+pixel column. Each bucket keeps its lowest and highest point, in their
+original order, so narrow spikes such as detections always survive.
+"""
+
+import numpy as np
+
+#Points kept per horizontal pixel, a min and a max
+POINTS_PER_PIXEL = 2
+
+
+def visible_range(length, x0, x1):
+    """ Bins from just left of x0 to just right of x1, so lines run to the
+        edges of the axes """
+    start = int(np.clip(np.floor(x0) - 1, 0, length))
+    stop = int(np.clip(np.ceil(x1) + 2, start, length))
+    return start, stop
+
+def minmax(y, start, stop, pixels):
+    """ Bins and values of y[start:stop], decimated to at most
+        POINTS_PER_PIXEL points per pixel by min/max. Short ranges come
+        back whole. """
+    y = np.asarray(y)[start:stop]
+    n = len(y)
+    buckets = max(int(pixels), 1)
+    if n <= POINTS_PER_PIXEL * buckets:
+        return np.arange(start, stop), y
+    size = -(-n // buckets)
+    full = n // size
+    rows = y[:full*size].reshape(full, size)
+    first = np.arange(full) * size
+    lo = rows.argmin(axis=1) + first
+    hi = rows.argmax(axis=1) + first
+    #Keep each pair in bin order so the line is traced left to right
+    idx = np.empty((full, 2), dtype=np.intp)
+    idx[:, 0] = np.minimum(lo, hi)
+    idx[:, 1] = np.maximum(lo, hi)
+    idx = idx.ravel()
+    if full*size < n:
+        tail = y[full*size:]
+        rest = full*size + np.sort([tail.argmin(), tail.argmax()])
+        idx = np.concatenate([idx, rest])
+    return idx + start, y[idx]
+
+def decimate(channels, x0, x1, pixels):
+    """ (bins, values) of every channel for the x0 to x1 zoom range drawn
+        across pixels pixels. None entries are passed through. """
+    out = []
+    for ch in channels:
+        if ch is None:
+            out.append(None)
+            continue
+        start, stop = visible_range(len(ch), x0, x1)
+        out.append(minmax(ch, start, stop, pixels))
+    return out
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def frame_count(nsamples, frame_len, hop):
+    """ Number of frames of frame_len samples, hop samples apart, that fit
+        entirely inside nsamples. """
+    if nsamples < frame_len:
+        return 0
+    return 1 + (nsamples - frame_len) // hop
+
+def frame_view(data, frame_len, hop):
+    """ Return a read-only (frames x frame_len) view of data where row i
+        starts at sample i*hop. No samples are copied, and any partial frame
+        at the end of data is left out. Data with more than one dimension,
+        such as channels x samples, is framed along its last axis. """
+    data = np.asarray(data)
+    count = frame_count(data.shape[-1], frame_len, hop)
+    stride = data.strides[-1]
+    return as_strided(data, shape=data.shape[:-1] + (count, frame_len),
+                      strides=data.strides[:-1] + (hop*stride, stride), writeable=False)
+
+#Window functions by name. Each is evaluated at length+1 points and the last
+#point dropped, which gives the periodic form used for spectral analysis.
+WINDOWS = {"rect": np.ones,
+           "hann": np.hanning,
+           "hamming": np.hamming,
+           "blackman": np.blackman,
+           "bartlett": np.bartlett}
+_window_cache = {}
+
+def get_window(name, length):
+    """ Periodic window of the given name and length. Windows are computed
+        once per (name, length) and shared, so treat them as read only. """
+    key = (name, length)
+    if key not in _window_cache:
+        if name not in WINDOWS:
+            raise ValueError("Unknown window " + str(name) + ", expected one of " + ", ".join(sorted(WINDOWS)))
+        _window_cache[key] = WINDOWS[name](length+1)[:-1]
+    return _window_cache[key]
+
+
+class Framer(object):
+    """ Short time Fourier transform settings - frames of frame_len samples,
+        hop samples apart, multiplied by a window and zero padded to fftlen
+        for a real input FFT. """
+    def __init__(self, frame_len, hop=None, fftlen=2048, window="rect"):
+        self.frame_len = frame_len
+        self.hop = frame_len if hop is None else hop
+        self.fftlen = fftlen
+        self.window_name = window
+        self.window = get_window(window, frame_len)
+
+    def frames(self, data):
+        """ Zero-copy frames x frame_len view of data, framed along its last
+            axis """
+        return frame_view(data, self.frame_len, self.hop)
+
+    def frame_count(self, nsamples):
+        """ Number of frames starting inside nsamples, counting partial
+            frames at the end """
+        return -(-nsamples // self.hop)
+
+    def spectra(self, frames):
+        """ Magnitude spectra of the rows of frames, first fftlen/2 bins.
+            Frames shorter than frame_len are zero padded. """
+        frames = np.asarray(frames)
+        short = self.frame_len - frames.shape[-1]
+        if short > 0:
+            pad = [(0, 0)] * (frames.ndim-1) + [(0, short)]
+            frames = np.pad(frames, pad, "constant")
+        #The rectangular window is all ones, so skip the multiply
+        if self.window_name != "rect":
+            frames = frames * self.window
+        fftlen = self.fftlen
+        return np.abs(np.fft.rfft(frames, fftlen, axis=-1))[..., :fftlen//2]
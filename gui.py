@@ -1,177 +1,75 @@
 #!/usr/bin/python
 
+import time
+#Startup times are measured from here, before any slow imports
+START = time.time()
 import sys
+import collections
+import threading
 from PyQt4 import QtGui as qtg
 from PyQt4 import QtCore as qtc
 
-from numpy import arange, sin, pi
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.patches import Rectangle
-from matplotlib.ticker import FuncFormatter
-import ExampleAlg
-import numpy as np
-import collections
-import types
-
 FPATH = "_05.wav"
-
-class MplCanvas(FigureCanvas):
-    """Ultimately, this is a QWidget (as well as a FigureCanvasAgg, etc.)."""
-    def __init__(self, parent=None, width=5, height=4, dpi=100):
-        self.fig = Figure(figsize=(width, height), dpi=dpi, facecolor='w')
-        self.axes = self.fig.add_subplot(1,1,1)
-
-        #Equivalent to hold(off) in MATLAB, i.e. each plot is fresh
-        #without showing old data
-        self.axes.hold(False)
-
-        #Plot color order. For more information
-        #see http://matplotlib.sourceforge.net/api/axes_api.html#matplotlib.axes.Axes.plot
-        self.colors = ['b', 'r', 'g', 'c', 'm']
-
-        #Zoom box color information
-        self.zoom_color = 'y'
-
-        #State variables must be here in order to retain state between
-        #plot calls
-        self.alg = ExampleAlg.ExampleAlg(FPATH)
-        self.zoom = {"x":[],
-                     "y":[]}
-
-        #State flag to see if zooming mode is active. Set in the left_pressed
-        #when the event for left_held is connected, then released when
-        #left_released is called
-        self.zooming = None
-
-        #Zoom_box holds the x and y values for current zoom box when
-        #self.zooming == True
-        self.zoom_box = {"x":{},
-                         "y":{}}
-        self.zoom_box["x"] = {"data_coords":[],
-                              "axes_coords":[]}
-        self.zoom_box["y"] = {"data_coords":[],
-                              "axes_coords":[]}
-
-        #State storage for the current cursor position in data coordinates
-        self.cursor_data = {}
-        self.cursor_data["x"] = 0
-        self.cursor_data["y"] = 0
-
-        #Setting to hold number of channels coming from algorithm
-        self.num_chans = 0
-        #Array which wil hold T/F values for which channels to display
-        self.display_chans = []
-
-        #Maximum zoom is 0, x_max and 0, y_max for the x and y axes
-        self.x_max = 0
-        self.y_max = 0
-        FigureCanvas.__init__(self, self.fig)
-        self.setParent(parent)
-
-class DynamicMplCanvas(MplCanvas):
-    """ A canvas that updates itself every X seconds with a new plot. """
-    def __init__(self, *args, **kwargs):
-        #Initialize parent
-        MplCanvas.__init__(self, *args, **kwargs)
-
-        #Set initial plot and initial states
-        self.compute_initial_figure()
-
-        #Create dynamic canvas and start plotting, set timer for graph updates
-        timer = qtc.QTimer(self)
-        qtc.QObject.connect(timer,qtc.SIGNAL("timeout()"),self.update_figure)
-        X = 750 #in milliseconds
-        timer.start(X)
-
-    def draw_figure(self, data):
-        """ Handles all the drawing code that is shared by the initial plotting
-            and the dynamic plotting. """
-        #Link channels in order with the colors list presented by self.colors.
-        #Note that if data is shorter than colors list, the end channels will
-        #"disappear"
-        #TODO: Add skip list to silence channels during runtime
-        display = self.display_chans
-        colors = self.colors
-        args = []
-        for tg, ch, col in zip(display, data, colors):
-            if tg == True:
-                args.append(ch)
-                args.append(col)
-
-        self.axes.plot(*args)
-
-        #xs and ys hold the state values for what we want the zoom to be
-        self.axes.set_xlim(self.zoom["x"][0], self.zoom["x"][1])
-        self.axes.set_ylim(self.zoom["y"][0], self.zoom["y"][1])
-
-        #Display X axes in units of frequency, but we want to leave all the state storage and algorithmic stuff in bin units
-        #self.axes.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: x*float(self.alg.framerate)/self.alg.fftlen))
-
-        #Draw lines for zooming rectangle, with one axis being in data coords
-        #and the other being in axes coords - see
-        #http://matplotlib.sourceforge.net/api/pyplot_api.html#matplotlib.pyplot.axhspan
-        if self.zooming != None:
-            try:
-                self.axes.axhspan(self.zoom_box["y"]["data_coords"][0],
-                                  self.zoom_box["y"]["data_coords"][1],
-                                  self.zoom_box["x"]["axes_coords"][0],
-                                  self.zoom_box["x"]["axes_coords"][1],
-                                  color=self.zoom_color,
-                                  alpha=.5)
-                self.axes.axvspan(self.zoom_box["x"]["data_coords"][0],
-                                  self.zoom_box["x"]["data_coords"][1],
-                                  self.zoom_box["y"]["axes_coords"][0],
-                                  self.zoom_box["y"]["axes_coords"][1],
-                                  color=self.zoom_color,
-                                  alpha=.5)
-            except IndexError:
-                #Ignore indexing exceptions - sometimes zoom_box has not been
-                #filled when plot is called
-                pass
-
-        #Create text in the bottom left that show the data coordinates which the
-        #mouse is currently hovering over
-        x = "%s" % float("%.2f" % self.cursor_data["x"])
-        y = "%s" % float("%.2f" % self.cursor_data["y"])
-        self.axes.text(-.1, -.1, "x="+x+"  y="+y, transform = self.axes.transAxes)
-        self.draw()
-
-    def compute_initial_figure(self):
-         """Initialize figure and set maximum X and maximum Y"""
-         #Get first result from algorithm
-         self.alg.start()
-         res = self.alg.run()
-
-         #Get number of chans in order to set up toggle boxes
-         self.num_chans = len(res)
-         self.display_chans = [False for i in range(self.num_chans)]
-
-         #Find maximum value of all channels, excluding DC term ([1:])
-         max_max = max(map(lambda x: max(x[1:]), res))
-
-         #Find length of longest channel
-         self.x_max = max(map(len, res))
-
-         #1.05 is a cushion value so that we can see all of the data at
-         #farthest zoom out
-         self.y_max = 1.05*max_max
-
-         #Set zoom state to maximum zoom out
-         self.zoom["x"] = [0, self.x_max]
-         self.zoom["y"] = [0, self.y_max]
-         self.axes.set_xlim(self.zoom["x"][0], self.zoom["x"][1])
-         self.axes.set_ylim(self.zoom["y"][0], self.zoom["y"][1])
-
-         self.draw_figure(res)
-
-    def update_figure(self):
-        """ Plot the new data, and set zoom levels to current state values. """
-        #Get values for next algorithm process
-        res = self.alg.run()
-
-        #Plot new data using configured color scheme
-        self.draw_figure(res)
+#Algorithms from host.REGISTRY to run side by side on the same spectra, for
+#example ("ExampleAlg", "ThresholdAlg")
+ALGORITHMS = ("ExampleAlg",)
+#Display refresh interval in milliseconds. Blitting keeps 30+ fps affordable.
+INTERVAL = 33
+BLIT = True
+#Directory of a store written by store.py to replay instead of running the
+#algorithms on FPATH
+REPLAY = None
+#Address of a pubsub.py server, like "tcp:localhost:5555", to show its
+#results instead of running the algorithms in this process
+SUBSCRIBE = None
+#How often the loading progress is checked during startup, in milliseconds
+STARTUP_INTERVAL = 50
+#Show per stage timings in the plot overlay, optionally logging them as JSON
+#lines to PROFILE_LOG. A nonzero CPROFILE_FRAMES runs cProfile over that many
+#frames of the algorithm and writes the stats to CPROFILE_PATH.
+PROFILE = False
+PROFILE_LOG = None
+CPROFILE_FRAMES = 0
+CPROFILE_PATH = "alg.prof"
+
+class Loader(threading.Thread):
+    """ Opens the file and sets up the algorithms off the GUI thread, then
+        reads through the rest of the file so playback never waits on the
+        disk. The algorithm is ready to run as soon as alg is set, before
+        the read through finishes. """
+    def __init__(self, path, algorithms):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.algorithms = algorithms
+        self.alg = None
+        self.progress = 0.
+        self.error = None
+        self.done = False
+
+    def run(self):
+        try:
+            if REPLAY:
+                import store
+                self.alg = store.ReplaySource(REPLAY)
+                return
+            if SUBSCRIBE:
+                import pubsub
+                self.alg = pubsub.Subscriber(SUBSCRIBE)
+                return
+            import host
+            self.alg = host.AlgHost(self.path, self.algorithms)
+            preload = getattr(self.alg.source, "preload", None)
+            if preload is not None:
+                preload(self.setProgress)
+        except (IOError, OSError, ValueError) as e:
+            self.error = "Unable to open " + str(REPLAY or SUBSCRIBE or self.path) + " - " + str(e)
+        finally:
+            self.progress = 1.
+            self.done = True
+
+    def setProgress(self, fraction):
+        self.progress = fraction
 
 class AlgGui(qtg.QWidget):
     """ Main GUI class, defines mouse and keyboard control functionality. """
@@ -179,14 +77,63 @@ class AlgGui(qtg.QWidget):
     #http://matplotlib.sourceforge.net/users/transforms_tutorial.html
     def __init__(self):
         qtg.QWidget.__init__(self)
-        self.graph = DynamicMplCanvas(self, width=10, height=10, dpi=100)
+        #The window comes up first with a progress bar. The plots, the
+        #algorithm and the controls are added by poll() as they get ready.
+        self.graph = None
+        self.waterfall = None
+        self.loader = Loader(FPATH, ALGORITHMS)
+        self.loader.start()
+
+        #Seconds from START to each startup milestone
+        self.startup = collections.OrderedDict()
 
         #Storage for click coordinates during click state
         self.coords = {"x":[],
                        "y":[]}
         self.initUI()
 
-    def genEditFunction(self, key, le, mn, mx):
+        self.startup_timer = qtc.QTimer(self)
+        qtc.QObject.connect(self.startup_timer, qtc.SIGNAL("timeout()"), self.poll)
+        self.startup_timer.start(STARTUP_INTERVAL)
+
+    def poll(self):
+        """ Move startup along by one step, called from a timer until the
+            file is loaded and the first frame is plotted """
+        self.progress.setValue(int(100*self.loader.progress))
+        if self.loader.error is not None:
+            self.status.setText(self.loader.error)
+            self.startup_timer.stop()
+            return
+
+        if self.graph is None:
+            #Runs on the first tick, after the window has been drawn
+            import qtcanvas
+            self.graph = qtcanvas.DynamicMplCanvas(self, width=10, height=10, dpi=100,
+                                                   interval=INTERVAL, blit=BLIT)
+            self.initGraph()
+        elif self.graph.alg is None and self.loader.alg is not None:
+            #Algorithm and drawing stages share one set of timings
+            profiler = self.loader.alg.profiler
+            profiler.enabled = PROFILE
+            if PROFILE_LOG:
+                profiler.open_log(PROFILE_LOG)
+            if CPROFILE_FRAMES:
+                profiler.capture(CPROFILE_FRAMES, CPROFILE_PATH)
+            self.graph.start(self.loader.alg)
+        elif self.graph.res is not None and self.waterfall is None:
+            #The canvas plots the first result on its own timer
+            self.startup["first_frame"] = time.time() - START
+            self.initControls()
+
+        if self.loader.done and "loaded" not in self.startup:
+            self.startup["loaded"] = time.time() - START
+        if self.waterfall is not None and self.loader.done:
+            self.status.hide()
+            self.progress.hide()
+            self.startup_timer.stop()
+            print("Startup: " + ", ".join("%s %.2fs" % kv for kv in self.startup.items()))
+
+    def genEditFunction(self, alg, key, le, mn, mx):
         """ Generator function for making a specific textChanged function
             in order to connect to a QLineEdit box. Only works for integer
             inputs to QLineEdit box. """
@@ -198,68 +145,90 @@ class AlgGui(qtg.QWidget):
 
             #Bounds checking
             if v.validate(string, pos) == qtg.QValidator.Invalid:
-               value = self.graph.alg.adjustable_params[key]["current_value"]
+               value = alg.adjustable_params[key]["current_value"]
                le.setText(str(value))
                print("Input of " + str(string) + " is outside range " + str(mn) + "," + str(mx))
             else:
                 try:
-                    self.graph.alg.adjustable_params[key]["current_value"] = int(string)
+                    alg.setParam(key, int(string))
                 except ValueError:
                     #Do this to suppress printing of error when line is blank
                     pass
         return textChanged
 
-    def genIdleFunction(self, key, le):
+    def genIdleFunction(self, alg, key, le):
         """ Generator for a super simple test of box contents. """
         def editingFinished():
             if len(le.text()) < 1:
-                self.graph.alg.adjustable_params[key]["min_value"]
+                alg.adjustable_params[key]["min_value"]
                 le.setText(str(value))
         return editingFinished
 
-    def genSliderFunction(self, key, le, mn, mx):
+    def genSliderFunction(self, alg, key, le, mn, mx):
         """ Generator function for making the value changed function for a particular slider """
         def valueChanged(value):
-            res = value*mx/100 if value*mx/100 > mn else mn
+            res = max(value*mx//100, mn)
             le.setText(str(res))
-            self.graph.alg.adjustable_params[key]["current_value"] = res
+            alg.setParam(key, res)
         return valueChanged
 
     def addSliders(self, widgets):
-        """ Function to add arbitrary number of sliders to the display """
-        for key in self.graph.alg.adjustable_params.keys():
-            #Add a label to the widgets dict
-            widgets[str(key) + "_label"] = qtg.QLabel(str(key))
-
-            #Get data extents for bounds checking
-            mn = self.graph.alg.adjustable_params[key]["min"]
-            mx = self.graph.alg.adjustable_params[key]["max"]
-
-            #Create a line edit widget and connect it to the generated
-            #textChanged function from the genEditFunction
-            le = qtg.QLineEdit(self)
-            edit = self.genEditFunction(key, le, mn, mx)
-            le.textChanged.connect(edit)
-
-            #Set text to min value if editing finishes as blank...
-            #Currently bugged in Ubuntu 11.10
-            fin = self.genIdleFunction(key, le)
-            le.editingFinished.connect(fin)
-
-            #Set text to default value
-            value = self.graph.alg.adjustable_params[key]["current_value"]
-            le.setText(str(value))
-            widgets[str(key) + "_current_value"] = le
-
-            #Create a slider, connect it to the generated sliderFunction,
-            #and add it to the widgets dict
-            sld = qtg.QSlider(qtc.Qt.Horizontal, self)
-            fn = self.genSliderFunction(key, le, mn, mx)
-            sld.valueChanged.connect(fn)
-            widgets[str(key) + "_slider"] = sld
-
-            #Add an empty space, so that widgets are better grouped visually
-            widgets[str(key) + "_spacer"] = qtg.QLabel(" ")
+        """ Function to add arbitrary number of sliders to the display, one
+            group per hosted algorithm """
+        for name, alg in self.graph.alg.algorithms.items():
+            #Algorithms may share parameter names, so widget names carry the
+            #algorithm name too
+            widgets[name + "_title"] = qtg.QLabel("<b>" + name + "</b>")
+            for key in alg.adjustable_params.keys():
+                prefix = name + "_" + str(key)
+                #Add a label to the widgets dict
+                widgets[prefix + "_label"] = qtg.QLabel(str(key))
+
+                #Get data extents for bounds checking
+                mn = alg.adjustable_params[key]["min"]
+                mx = alg.adjustable_params[key]["max"]
+
+                #Create a line edit widget and connect it to the generated
+                #textChanged function from the genEditFunction
+                le = qtg.QLineEdit(self)
+                edit = self.genEditFunction(alg, key, le, mn, mx)
+                le.textChanged.connect(edit)
+
+                #Set text to min value if editing finishes as blank...
+                #Currently bugged in Ubuntu 11.10
+                fin = self.genIdleFunction(alg, key, le)
+                le.editingFinished.connect(fin)
+
+                #Set text to default value
+                value = alg.adjustable_params[key]["current_value"]
+                le.setText(str(value))
+                widgets[prefix + "_current_value"] = le
+
+                #Create a slider, connect it to the generated sliderFunction,
+                #and add it to the widgets dict
+                sld = qtg.QSlider(qtc.Qt.Horizontal, self)
+                fn = self.genSliderFunction(alg, key, le, mn, mx)
+                sld.valueChanged.connect(fn)
+                widgets[prefix + "_slider"] = sld
+
+                #Add an empty space, so that widgets are better grouped visually
+                widgets[prefix + "_spacer"] = qtg.QLabel(" ")
+
+    def addReplayControls(self, widgets):
+        """ Position and playback speed sliders for replaying a store """
+        alg = self.graph.alg
+        widgets["replay_label"] = qtg.QLabel("<b>Replay</b>")
+        widgets["position_label"] = qtg.QLabel("position")
+        sld = qtg.QSlider(qtc.Qt.Horizontal, self)
+        sld.setRange(0, max(alg.frameCount()-1, 0))
+        sld.valueChanged.connect(alg.seek)
+        widgets["position_slider"] = sld
+        widgets["speed_label"] = qtg.QLabel("speed")
+        sld = qtg.QSlider(qtc.Qt.Horizontal, self)
+        sld.setRange(1, 64)
+        sld.valueChanged.connect(alg.setSpeed)
+        widgets["speed_slider"] = sld
+        widgets["replay_spacer"] = qtg.QLabel(" ")
 
     def boundsCheck(self, xdata, ydata):
         """Make sure that zoom boundaries are within data window"""
@@ -352,15 +321,31 @@ class AlgGui(qtg.QWidget):
 
     def addCheckboxes(self, widgets):
         """Add textboxes to passed in collection."""
+        #Labelled with the output and audio channel each one shows
+        names = self.graph.alg.channelNames()
         for i in range(self.graph.num_chans):
-            cb = qtg.QCheckBox()
+            cb = qtg.QCheckBox(names[i])
             widgets['chan_'+str(i)+'checkbox'] = cb
             fn = self.genCheckboxFunction(i)
             cb.stateChanged.connect(fn)
 
     def initLayout(self):
-        hbox = qtg.QHBoxLayout()
+        self.hbox = qtg.QHBoxLayout()
+
+        self.vbox = qtg.QVBoxLayout()
+        self.hbox.addStretch(1)
+        self.hbox.addLayout(self.vbox)
+
+        #Shown until the file is loaded
+        self.status = qtg.QLabel("Loading " + str(FPATH))
+        self.progress = qtg.QProgressBar(self)
+        self.progress.setRange(0, 100)
+        self.vbox.addWidget(self.status)
+        self.vbox.addWidget(self.progress)
 
+        self.setLayout(self.hbox)
+
+    def initGraph(self):
         #Click and drag zooming functions
         self.zoom_start = self.graph.mpl_connect("button_press_event", self.left_pressed)
         self.zoom_end = self.graph.mpl_connect("button_release_event", self.left_released)
@@ -371,35 +356,54 @@ class AlgGui(qtg.QWidget):
         #Cursor positional display
         self.cursor_pos = self.graph.mpl_connect("motion_notify_event", self.display_cursor_point)
 
-        #Plot graphic
-        hbox.addWidget(self.graph)
+        #Plot graphic, left of everything else
+        self.hbox.insertWidget(0, self.graph)
+
+    def initControls(self):
+        """ Add the waterfall and the controls, which depend on the
+            algorithms and on the first result """
+        import qtcanvas
+        spectrum = self.graph.res[0]
+        self.waterfall = qtcanvas.WaterfallCanvas(self, bins=len(spectrum),
+                                                  clim=qtcanvas.waterfall_clim(spectrum),
+                                                  width=5, height=10, dpi=100)
+        self.waterfall.add(spectrum, self.graph.res[-self.graph.alg.nchannels])
+        self.graph.waterfall = self.waterfall
 
-        vbox = qtg.QVBoxLayout()
-        hbox.addStretch(1)
-        hbox.addLayout(vbox)
+        #Waterfall history next to the plot
+        self.hbox.insertWidget(1, self.waterfall)
+        vbox = self.vbox
 
         #Top right widgets, pass in widgets dict so sliders can be added
         widgets = collections.OrderedDict()
+        if hasattr(self.graph.alg, "seek"):
+            self.addReplayControls(widgets)
         self.addSliders(widgets)
         [vbox.addWidget(x) for x in widgets.values()]
 
         vbox.addStretch(1)
 
         #Bottom right widgets, pass in checbox_widgets so checkboxes can be added
+        #Multichannel files have too many channels for one row
         vbox.addWidget(qtg.QLabel("Enable Channels 1 - "+str(self.graph.num_chans)))
-        hbox_check = qtg.QHBoxLayout()
+        hbox_check = qtg.QHBoxLayout() if self.graph.num_chans <= 5 else qtg.QVBoxLayout()
         checkbox_widgets = collections.OrderedDict()
         self.addCheckboxes(checkbox_widgets)
         [hbox_check.addWidget(x) for x in checkbox_widgets.values()]
         vbox.addLayout(hbox_check)
 
-        self.setLayout(hbox)
+        #Set window title to the names of the included algorithms
+        alg = self.graph.alg
+        if SUBSCRIBE:
+            self.setWindowTitle(alg.title + " from " + str(SUBSCRIBE))
+        else:
+            self.setWindowTitle(" / ".join(alg.algorithms) or "Replay " + str(REPLAY))
 
     def initUI(self):
-        #Set window title to the name of the included algorithm
-        self.setWindowTitle(self.graph.alg.__class__.__name__)
+        self.setWindowTitle("Loading " + str(FPATH))
         self.initLayout()
         self.show()
+        self.startup["window"] = time.time() - START
 
 if __name__ == "__main__":
     app = qtg.QApplication(sys.argv)
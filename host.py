@@ -0,0 +1,115 @@
+#!/usr/bin/python
+""" Runs several detection algorithms side by side on one stream.
+
+The host reads each frame and computes its spectrum once, then hands the
+spectrum to every algorithm at the same time on a thread pool. Algorithms are
+looked up by name in REGISTRY. Any class with adjustable_params, setParam(),
+OUTPUTS and process(spectrum, frame_id) can be registered. The spectrum is
+channels x bins, and process() returns a list of output channels, one per
+entry of OUTPUTS and audio channel. ExampleAlg subclasses only need to
+override _alg.
+
+    alg = host.AlgHost("_05.wav", ["ExampleAlg", "ThresholdAlg"])
+    res = alg.run()   #spectra + channels of ExampleAlg + of ThresholdAlg
+"""
+
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import framing
+import sources
+import cache
+import instrument
+import ExampleAlg
+import ThresholdAlg
+
+#Algorithm classes by name
+REGISTRY = collections.OrderedDict()
+
+
+def register(cls, name=None):
+    """ Make cls available to AlgHost under name, by default its class name.
+        Returns cls, so it can be used as a class decorator. """
+    REGISTRY[cls.__name__ if name is None else name] = cls
+    return cls
+
+register(ExampleAlg.ExampleAlg)
+register(ThresholdAlg.ThresholdAlg)
+
+
+class AlgHost(threading.Thread):
+    def __init__(self, wav_path=None, algorithms=("ExampleAlg",), source=None,
+                 frame_len=ExampleAlg.FRAME_LEN, hop=None, fftlen=ExampleAlg.FFTLEN,
+                 window=ExampleAlg.WINDOW, cache_bytes=ExampleAlg.CACHE_BYTES):
+        """ Analyze the WAV file at wav_path, or frames from source, with
+            each of the named algorithms. Framing arguments are the same as
+            for ExampleAlg. """
+        threading.Thread.__init__(self)
+        if source is None:
+            source = sources.FileSource(wav_path, frame_len, hop)
+        self.source = source
+        self.frame_len = source.frame_len
+        self.hop = source.hop
+        self.fftlen = fftlen
+        self.framer = framing.Framer(self.frame_len, self.hop, fftlen, window)
+        self.wavdata = getattr(source, "samples", None)
+        self.all_params = source.params
+        self.nchannels = self.all_params[0]
+        self.sampwidth = self.all_params[1]
+        self.framerate = self.all_params[2]
+        self.nframes = self.all_params[3]
+
+        self.frame_id = None
+        self.spectrum_cache = cache.LRUCache(cache_bytes)
+        self.profiler = instrument.Profiler()
+
+        #Algorithms never read the source themselves, they are only given
+        #it for its parameters
+        self.algorithms = collections.OrderedDict()
+        for name in algorithms:
+            try:
+                cls = REGISTRY[name]
+            except KeyError:
+                raise ValueError("Unknown algorithm " + str(name) + ", expected one of " + ", ".join(REGISTRY))
+            alg = cls(source=source, fftlen=fftlen, window=window, cache_bytes=cache_bytes)
+            alg.profiler = self.profiler
+            self.algorithms[name] = alg
+        self.pool = ThreadPoolExecutor(max(1, len(self.algorithms)))
+
+    def _channel(self):
+        frame = self.source.next_frame()
+        self.frame_id = self.source.frame_id
+        if self.frame_id is None:
+            return self.framer.spectra(frame)
+        spectrum = self.spectrum_cache.get(self.frame_id)
+        if spectrum is None:
+            spectrum = self.framer.spectra(frame)
+            self.spectrum_cache.put(self.frame_id, spectrum)
+        return spectrum
+
+    def channelNames(self):
+        """ Label of each channel of run()'s result """
+        names = ExampleAlg.channel_names(("spectrum",), self.nchannels)
+        for name, alg in self.algorithms.items():
+            names += ExampleAlg.channel_names(alg.OUTPUTS, self.nchannels, name + " ")
+        return names
+
+    def run(self):
+        with self.profiler.stage("fft"):
+            spectrum = np.asarray(self._channel())
+        frame_id = self.frame_id
+        algs = list(self.algorithms.values())
+        if len(algs) == 1:
+            results = [algs[0].process(spectrum, frame_id)]
+        else:
+            #numpy releases the GIL in most of the heavy lifting, so the
+            #algorithms do overlap
+            futures = [self.pool.submit(alg.process, spectrum, frame_id) for alg in algs]
+            results = [f.result() for f in futures]
+        #Spectra of each audio channel, then every algorithm's outputs
+        out = list(spectrum)
+        for res in results:
+            out.extend(res)
+        self.profiler.end_frame()
+        return out
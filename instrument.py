@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+import collections
+import cProfile
+import json
+import threading
+import time
+import numpy as np
+
+#Number of recent timings per stage kept for the rolling percentiles
+WINDOW = 500
+#Monotonic, high resolution clock for stage durations. time.time() is only
+#used for wall clock timestamps in the log.
+_clock = getattr(time, "perf_counter", time.time)  # python2.x has no perf_counter
+
+
+class _NullStage(object):
+    """ Context manager that does nothing, handed out while timing is off """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, _clock() - self.start)
+        return False
+
+
+class Profiler(object):
+    """ Rolling timings of named pipeline stages.
+
+        with profiler.stage("fft"):
+            ...
+
+        Stage timings are kept for the last WINDOW calls of each stage. With
+        a log file open, end_frame() writes the timings of the frame as one
+        JSON line. capture() runs cProfile over the next N frames. While
+        disabled, stage() hands out a shared no-op context manager, so hooks
+        cost one method call. """
+    def __init__(self, enabled=False, window=WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.timings = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self.frame = {}
+        self.frames = 0
+        self.log = None
+        self.cprofile = None
+        self.capture_frames = 0
+        self.capture_path = None
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """ Context manager timing one run of stage name """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.timings[name].append(seconds)
+            self.frame[name] = self.frame.get(name, 0) + seconds
+
+    def end_frame(self):
+        """ Mark the end of one frame of processing """
+        if not self.enabled and self.capture_path is None:
+            return
+        with self.lock:
+            frame, self.frame = self.frame, {}
+            self.frames += 1
+            if self.log is not None:
+                self.log.write(json.dumps({"frame": self.frames, "time": time.time(),
+                                           "stages": frame}) + "\n")
+        self._stepCapture()
+
+    def stats(self):
+        """ p50, p95 and max in seconds, and sample count, by stage """
+        with self.lock:
+            snapshot = dict((k, list(v)) for k, v in self.timings.items())
+        stats = collections.OrderedDict()
+        for name in sorted(snapshot):
+            t = np.array(snapshot[name])
+            if len(t) == 0:
+                continue
+            p50, p95 = np.percentile(t, [50, 95])
+            stats[name] = {"p50": p50, "p95": p95, "max": t.max(), "count": len(t)}
+        return stats
+
+    def summary(self, sep="\n"):
+        """ p50/p95/max milliseconds of each stage, joined by sep, for
+            display """
+        lines = []
+        for name, s in self.stats().items():
+            lines.append("%s %.1f/%.1f/%.1f ms" % (name, 1E3*s["p50"], 1E3*s["p95"], 1E3*s["max"]))
+        return sep.join(lines)
+
+    def open_log(self, path):
+        """ Write the stage timings of every frame to path as JSON lines """
+        with self.lock:
+            self.close_log()
+            self.log = open(path, "a")
+
+    def close_log(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def capture(self, nframes, path):
+        """ Run cProfile on the thread calling end_frame for the next nframes
+            frames, then write the stats to path for pstats """
+        self.capture_frames = nframes
+        self.capture_path = path
+
+    def _stepCapture(self):
+        #cProfile only sees the thread which enables it, so start it from
+        #end_frame on the processing thread rather than in capture()
+        if self.capture_path is None:
+            return
+        if self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+            return
+        self.capture_frames -= 1
+        if self.capture_frames <= 0:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.capture_path)
+            self.cprofile = None
+            self.capture_path = None
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+""" Drawing code for the spectrum plot. It has no Qt dependency, so the same
+    code renders into the GUI's canvas and onto a plain Agg canvas. """
+
+import numpy as np
+from matplotlib.patches import Rectangle
+from matplotlib import transforms
+import instrument
+import decimate
+
+
+class PlotMixin(object):
+    """ Spectrum plot drawing for a FigureCanvasAgg subclass. Expects
+        self.fig and self.axes to exist before init_plot_state is called. """
+    def init_plot_state(self):
+        """ Set up the state which has to persist between plot calls """
+        #Plot color order. For more information
+        #see http://matplotlib.sourceforge.net/api/axes_api.html#matplotlib.axes.Axes.plot
+        self.colors = ['b', 'r', 'g', 'c', 'm']
+
+        #Zoom box color information
+        self.zoom_color = 'y'
+
+        #State variables must be here in order to retain state between
+        #plot calls
+        self.zoom = {"x":[],
+                     "y":[]}
+
+        #State flag to see if zooming mode is active. Set in the left_pressed
+        #when the event for left_held is connected, then released when
+        #left_released is called
+        self.zooming = None
+
+        #Zoom_box holds the x and y values for current zoom box when
+        #self.zooming == True
+        self.zoom_box = {"x":{},
+                         "y":{}}
+        self.zoom_box["x"] = {"data_coords":[],
+                              "axes_coords":[]}
+        self.zoom_box["y"] = {"data_coords":[],
+                              "axes_coords":[]}
+
+        #State storage for the current cursor position in data coordinates
+        self.cursor_data = {}
+        self.cursor_data["x"] = 0
+        self.cursor_data["y"] = 0
+
+        #Setting to hold number of channels coming from algorithm
+        self.num_chans = 0
+        #Array which wil hold T/F values for which channels to display
+        self.display_chans = []
+
+        #Maximum zoom is 0, x_max and 0, y_max for the x and y axes
+        self.x_max = 0
+        self.y_max = 0
+
+        #Optional worker.AlgWorker whose counters are shown in the overlay
+        self.worker = None
+
+        #Timing of draw calls, shown in the overlay when enabled
+        self.profiler = instrument.Profiler()
+
+        #Reduce channels to about two points per pixel of the visible range
+        #before plotting
+        self.decimate = True
+
+        #Artists and cached background for blitting, created on first draw
+        self.use_blit = False
+        self.lines = None
+        self.background = None
+        self.drawn_zoom = None
+
+    def overlay_text(self):
+        """ Text for the bottom left of the plot """
+        #Data coordinates which the mouse is currently hovering over
+        x = "%s" % float("%.2f" % self.cursor_data["x"])
+        y = "%s" % float("%.2f" % self.cursor_data["y"])
+        #Worker queue depth and number of results dropped because drawing
+        #could not keep up
+        stats = ""
+        if self.worker is not None:
+            stats = "  queue=%d  skipped=%d" % (self.worker.depth(), self.worker.skipped)
+            #The algorithm is failing, so the plot is showing an old result
+            if self.worker.error is not None:
+                stats += "  error=" + self.worker.error
+        #Per stage p50/p95/max timings
+        if self.profiler.enabled:
+            stats += "  " + self.profiler.summary("  ")
+        return "x="+x+"  y="+y+stats
+
+    def display_data(self, data):
+        """ (bins, values) to plot for each channel, or None for channels
+            which are switched off. Only the zoomed range is kept, min/max
+            decimated to the width of the axes in pixels when enabled. """
+        channels = [ch if tg == True else None for tg, ch in zip(self.display_chans, data)]
+        if not self.decimate:
+            return [None if ch is None else (np.arange(len(ch)), ch) for ch in channels]
+        x0, x1 = self.zoom["x"]
+        return decimate.decimate(channels, x0, x1, self.axes.bbox.width)
+
+    def draw_figure(self, data):
+        """ Handles all the drawing code that is shared by the initial plotting
+            and the dynamic plotting. """
+        with self.profiler.stage("draw"):
+            if self.use_blit:
+                self.blit_figure(data)
+            else:
+                self.redraw_figure(data)
+
+    def redraw_figure(self, data):
+        """ Rebuild the whole plot from data """
+        #Link channels in order with the colors list presented by self.colors,
+        #colors repeat if there are more channels than colors
+        #TODO: Add skip list to silence channels during runtime
+        colors = self.colors
+        args = []
+        for i, xy in enumerate(self.display_data(data)):
+            if xy is not None:
+                args.extend(xy)
+                args.append(colors[i % len(colors)])
+
+        #Each plot is fresh without showing old data, like hold(off) in
+        #MATLAB
+        self.axes.cla()
+        self.axes.plot(*args)
+
+        #xs and ys hold the state values for what we want the zoom to be
+        self.axes.set_xlim(self.zoom["x"][0], self.zoom["x"][1])
+        self.axes.set_ylim(self.zoom["y"][0], self.zoom["y"][1])
+
+        #Display X axes in units of frequency, but we want to leave all the state storage and algorithmic stuff in bin units
+        #self.axes.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: x*float(self.alg.framerate)/self.alg.fftlen))
+
+        #Draw lines for zooming rectangle, with one axis being in data coords
+        #and the other being in axes coords - see
+        #http://matplotlib.sourceforge.net/api/pyplot_api.html#matplotlib.pyplot.axhspan
+        if self.zooming != None:
+            try:
+                self.axes.axhspan(self.zoom_box["y"]["data_coords"][0],
+                                  self.zoom_box["y"]["data_coords"][1],
+                                  self.zoom_box["x"]["axes_coords"][0],
+                                  self.zoom_box["x"]["axes_coords"][1],
+                                  color=self.zoom_color,
+                                  alpha=.5)
+                self.axes.axvspan(self.zoom_box["x"]["data_coords"][0],
+                                  self.zoom_box["x"]["data_coords"][1],
+                                  self.zoom_box["y"]["axes_coords"][0],
+                                  self.zoom_box["y"]["axes_coords"][1],
+                                  color=self.zoom_color,
+                                  alpha=.5)
+            except IndexError:
+                #Ignore indexing exceptions - sometimes zoom_box has not been
+                #filled when plot is called
+                pass
+
+        #Create text in the bottom left that show the data coordinates which the
+        #mouse is currently hovering over
+        self.axes.text(-.1, -.1, self.overlay_text(), transform = self.axes.transAxes)
+        self.draw()
+
+    def init_blit_artists(self, data):
+        """ Create every artist used by blit_figure once. They are all
+            animated, so full redraws leave them out of the cached
+            background. """
+        #One line per channel, colors repeat if there are more channels than
+        #colors
+        args = []
+        for i, ch in enumerate(data):
+            args.append(np.arange(len(ch)))
+            args.append(ch)
+            args.append(self.colors[i % len(self.colors)])
+        self.lines = self.axes.plot(*args)
+
+        #Zoom box halves, one axis in data coords and the other in axes coords
+        #like axhspan/axvspan
+        x_axes = transforms.blended_transform_factory(self.axes.transAxes, self.axes.transData)
+        y_axes = transforms.blended_transform_factory(self.axes.transData, self.axes.transAxes)
+        self.zoom_patches = [Rectangle((0, 0), 0, 0, transform=x_axes, color=self.zoom_color, alpha=.5),
+                             Rectangle((0, 0), 0, 0, transform=y_axes, color=self.zoom_color, alpha=.5)]
+        for patch in self.zoom_patches:
+            self.axes.add_patch(patch)
+
+        self.text = self.axes.text(-.1, -.1, "", transform = self.axes.transAxes)
+        for artist in self.lines + self.zoom_patches + [self.text]:
+            artist.set_animated(True)
+
+    def cache_background(self, event=None):
+        """ Save everything except the animated artists for blitting """
+        self.background = self.copy_from_bbox(self.fig.bbox)
+
+    def blit_figure(self, data):
+        """ Update the persistent artists with new data and blit them over the
+            cached background. The whole figure is only redrawn when the zoom
+            state changes. """
+        if self.lines is None:
+            self.init_blit_artists(data)
+
+        zoom = (tuple(self.zoom["x"]), tuple(self.zoom["y"]))
+        if zoom != self.drawn_zoom or self.background is None:
+            self.axes.set_xlim(self.zoom["x"][0], self.zoom["x"][1])
+            self.axes.set_ylim(self.zoom["y"][0], self.zoom["y"][1])
+            self.drawn_zoom = zoom
+            #Triggers cache_background through the draw event
+            self.draw()
+        self.restore_region(self.background)
+
+        for line, tg, xy in zip(self.lines, self.display_chans, self.display_data(data)):
+            line.set_visible(tg)
+            if xy is not None:
+                line.set_data(*xy)
+                self.axes.draw_artist(line)
+
+        if self.zooming != None:
+            try:
+                x_axes, y_axes = self.zoom_patches
+                xd = self.zoom_box["x"]["data_coords"]
+                yd = self.zoom_box["y"]["data_coords"]
+                xa = self.zoom_box["x"]["axes_coords"]
+                ya = self.zoom_box["y"]["axes_coords"]
+                x_axes.set_bounds(xa[0], yd[0], xa[1]-xa[0], yd[1]-yd[0])
+                y_axes.set_bounds(xd[0], ya[0], xd[1]-xd[0], ya[1]-ya[0])
+                self.axes.draw_artist(x_axes)
+                self.axes.draw_artist(y_axes)
+            except (IndexError, ValueError):
+                #zoom_box has not been filled yet
+                pass
+
+        self.text.set_text(self.overlay_text())
+        self.axes.draw_artist(self.text)
+        self.blit(self.fig.bbox)
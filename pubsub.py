@@ -0,0 +1,325 @@
+#!/usr/bin/python
+""" Share one analysis pipeline between any number of viewers.
+
+    python pubsub.py capture.wav tcp:localhost:5555 -a ExampleAlg -a ThresholdAlg
+
+ResultServer runs an algorithm once and publishes every frame's channels,
+the same list run() returns, over a local TCP or Unix socket. Viewers
+connect with a Subscriber, which stands in for the algorithm in
+DynamicMplCanvas. Each subscriber gets its own bounded queue and sender
+thread, and a subscriber that falls behind loses its oldest frames instead
+of holding up the pipeline or the other subscribers.
+
+Every message is a HEADER followed by a rows x bins array of raw little
+endian values, sent straight from the array's memory. The first message on
+each connection is a HELLO, a JSON description of the channels as bytes.
+Every other message is a FRAME.
+"""
+
+import argparse
+import collections
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+try:
+    import queue
+except ImportError:  # python2.x
+    import Queue as queue
+import numpy as np
+import instrument
+import sources
+
+MAGIC = b"CRES"
+#magic, dtype kind and item size ("f4"), message kind, sequence number,
+#frame_id (-1 for none), rows, bins
+HEADER = struct.Struct("<4s2sHIqII")
+HELLO = 0
+FRAME = 1
+#Frames queued per subscriber before its oldest are dropped
+DEPTH = 8
+
+
+def encode(kind, seq, frame_id, array):
+    """ Header for a message carrying the 2 dimensional, C contiguous,
+        little endian array """
+    rows, bins = array.shape
+    code = (array.dtype.kind + str(array.dtype.itemsize)).encode("ascii")
+    return HEADER.pack(MAGIC, code, kind, seq, -1 if frame_id is None else frame_id,
+                       rows, bins)
+
+def _recv_into(sock, view):
+    got = 0
+    while got < len(view):
+        n = sock.recv_into(view[got:])
+        if not n:
+            raise EOFError("Publisher closed the connection")
+        got += n
+
+def read_message(sock):
+    """ Read one message from sock. Returns (kind, seq, frame_id, array),
+        with frame_id None for frames without one. The array is received
+        directly into its own memory. """
+    header = bytearray(HEADER.size)
+    _recv_into(sock, memoryview(header))
+    magic, code, kind, seq, frame_id, rows, bins = HEADER.unpack(bytes(header))
+    if magic != MAGIC:
+        raise ValueError("Not a result stream")
+    array = np.empty((rows, bins), dtype="<" + code.decode("ascii"))
+    if array.size:
+        _recv_into(sock, memoryview(array.reshape(-1).view(np.uint8)))
+    return kind, seq, None if frame_id < 0 else frame_id, array
+
+def listen(address, backlog=16):
+    """ Listening socket on a Unix socket path or (host, port). A stale
+        socket file left at the path is replaced. """
+    if isinstance(address, tuple):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    else:
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.remove(address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+def connect(address):
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class _Connection(threading.Thread):
+    """ One subscriber on the server side. Messages are queued by send()
+        without ever blocking and written out by this thread. When the
+        queue is full the oldest message is dropped and counted. """
+    def __init__(self, sock, depth):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.messages = queue.Queue(depth)
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    def send(self, header, array):
+        while not self.closed:
+            try:
+                self.messages.put_nowait((header, array))
+                return
+            except queue.Full:
+                try:
+                    self.messages.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        try:
+            while not self.closed:
+                try:
+                    header, array = self.messages.get(timeout=.1)
+                except queue.Empty:
+                    continue
+                self.sock.sendall(header)
+                if array.size:
+                    self.sock.sendall(memoryview(array.reshape(-1).view(np.uint8)))
+                self.sent += 1
+        except (IOError, OSError):
+            #Subscriber went away
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except (IOError, OSError):
+            pass
+
+
+class ResultServer(threading.Thread):
+    """ Calls alg.run() on this thread and publishes each result to every
+        subscriber connected to address, a Unix socket path or a (host,
+        port) tuple. Port 0 picks a free port, see self.address. Channels
+        are sent as dtype. File backed algorithms are played back in real
+        time unless interval, the seconds between frames, says otherwise.
+        Each subscriber can fall depth frames behind before it starts
+        losing frames. """
+    def __init__(self, alg, address, depth=DEPTH, dtype="<f4", interval=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.alg = alg
+        self.depth = depth
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        if interval is None:
+            #Live sources pace themselves
+            interval = float(alg.hop) / alg.framerate if alg.wavdata is not None else 0
+        self.interval = interval
+        self.listener = listen(address)
+        self.listener.settimeout(.1)
+        self.address = self.listener.getsockname()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.published = 0
+
+        info = collections.OrderedDict()
+        info["channels"] = alg.channelNames()
+        info["nchannels"] = alg.nchannels
+        info["algorithms"] = list(getattr(alg, "algorithms", None) or [type(alg).__name__])
+        info["framerate"] = getattr(alg, "framerate", None)
+        info["hop"] = getattr(alg, "hop", None)
+        hello = np.frombuffer(json.dumps(info).encode("utf-8"), dtype=np.uint8)
+        self.hello = hello.reshape(1, -1)
+
+        self.acceptor = threading.Thread(target=self._accept)
+        self.acceptor.daemon = True
+        self.acceptor.start()
+
+    def _accept(self):
+        while not self.stopped.is_set():
+            try:
+                sock, addr = self.listener.accept()
+            except socket.timeout:
+                continue
+            except (IOError, OSError):
+                break
+            sock.settimeout(None)
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(sock, self.depth)
+            #The hello goes first, into an empty queue, so it is never dropped
+            conn.send(encode(HELLO, 0, None, self.hello), self.hello)
+            conn.start()
+            with self.lock:
+                self.connections.append(conn)
+
+    def publish(self, res, frame_id=None):
+        """ Queue one result, a list of equal length channels, for every
+            subscriber. The channels are stacked into one array that all
+            subscribers send from. """
+        frame = np.ascontiguousarray(np.asarray(res, dtype=self.dtype))
+        header = encode(FRAME, self.published, frame_id, frame)
+        self.published += 1
+        with self.lock:
+            self.connections = [c for c in self.connections if not c.closed]
+            connections = list(self.connections)
+        for conn in connections:
+            conn.send(header, frame)
+
+    def run(self):
+        next_time = time.time()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    res = self.alg.run()
+                except EOFError:
+                    break
+                self.publish(res, self.alg.frame_id)
+                if self.interval:
+                    next_time = max(next_time + self.interval, time.time() - self.interval)
+                    delay = next_time - time.time()
+                    if delay > 0:
+                        self.stopped.wait(delay)
+        finally:
+            self.close()
+
+    def stats(self):
+        """ Frames sent and dropped for each connected subscriber """
+        with self.lock:
+            return [{"sent": c.sent, "dropped": c.dropped} for c in self.connections
+                    if not c.closed]
+
+    def close(self):
+        self.stopped.set()
+        self.listener.close()
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class Subscriber(object):
+    """ Receives the results published by a ResultServer at address, a
+        socket address or a "unix:PATH" / "tcp:HOST:PORT" string. Stands in
+        for the algorithm in DynamicMplCanvas - run() returns the channels of
+        the next frame. Frames the server dropped for this subscriber are
+        counted in missed. Parameters belong to the server, so there are no
+        adjustable algorithms here. """
+    #Live data, stale results are dropped rather than paced
+    wavdata = None
+    paced = False
+
+    def __init__(self, address, timeout=None):
+        if not isinstance(address, tuple):
+            address = sources.parse_address(address) or address
+        self.sock = connect(address)
+        self.sock.settimeout(timeout)
+        kind, seq, frame_id, hello = read_message(self.sock)
+        if kind != HELLO:
+            raise ValueError("Result stream did not start with a hello")
+        self.info = json.loads(hello.tobytes().decode("utf-8"))
+        self.nchannels = self.info["nchannels"]
+        self.title = " / ".join(self.info["algorithms"])
+        self.algorithms = collections.OrderedDict()
+        self.profiler = instrument.Profiler()
+        self.frame_id = None
+        self.seq = None
+        self.missed = 0
+
+    def channelNames(self):
+        return list(self.info["channels"])
+
+    def run(self):
+        with self.profiler.stage("receive"):
+            kind, seq, frame_id, frame = read_message(self.sock)
+        if self.seq is not None:
+            self.missed += max(seq - self.seq - 1, 0)
+        self.seq = seq
+        self.frame_id = frame_id
+        self.profiler.end_frame()
+        return list(frame)
+
+    def close(self):
+        self.sock.close()
+
+
+def main(argv=None):
+    import host
+    parser = argparse.ArgumentParser(description="Analyze a WAV file once and publish the results to any number of viewers")
+    parser.add_argument("wav", help="WAV file to analyze, looped forever")
+    parser.add_argument("address", help="where to publish, unix:PATH or tcp:HOST:PORT")
+    parser.add_argument("-a", "--algorithm", action="append", default=[],
+                        help="algorithm from host.REGISTRY, may be repeated, default ExampleAlg")
+    parser.add_argument("--depth", type=int, default=DEPTH, help="frames queued per subscriber before dropping")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="seconds between frames, default real time")
+    args = parser.parse_args(argv)
+
+    address = sources.parse_address(args.address)
+    if address is None:
+        parser.error("address must be unix:PATH or tcp:HOST:PORT")
+    alg = host.AlgHost(args.wav, args.algorithm or ("ExampleAlg",))
+    server = ResultServer(alg, address, args.depth, interval=args.interval)
+    print("Publishing %s on %s" % (" / ".join(alg.algorithms), args.address))
+    server.start()
+    try:
+        while server.is_alive():
+            server.join(1)
+    except KeyboardInterrupt:
+        server.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+""" Qt widgets for the spectrum plot and the waterfall. Importing matplotlib's
+    Qt backend is slow, so the GUI only imports this module once its window
+    is up. """
+
+from PyQt4 import QtCore as qtc
+
+from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib import cm
+import copy
+import numpy as np
+import plotcanvas
+import worker
+import waterfall
+
+#Number of spectra kept in the waterfall history
+WATERFALL_ROWS = 2000
+#Plot updates per waterfall redraw. Results are still added on every update.
+WATERFALL_EVERY = 3
+
+class MplCanvas(plotcanvas.PlotMixin, FigureCanvas):
+    """Ultimately, this is a QWidget (as well as a FigureCanvasAgg, etc.)."""
+    def __init__(self, parent=None, width=5, height=4, dpi=100):
+        self.fig = Figure(figsize=(width, height), dpi=dpi, facecolor='w')
+        self.axes = self.fig.add_subplot(1,1,1)
+
+        #State variables must be here in order to retain state between
+        #plot calls. The algorithm is attached later by start(), once its
+        #source is open.
+        self.alg = None
+        self.res = None
+        self.init_plot_state()
+        FigureCanvas.__init__(self, self.fig)
+        self.setParent(parent)
+
+class DynamicMplCanvas(MplCanvas):
+    """ A canvas that updates itself every X seconds with a new plot. Shows
+        nothing until start() hands it an algorithm and the first result is
+        in, and never waits for the algorithm itself. """
+    def __init__(self, *args, **kwargs):
+        #Refresh interval in milliseconds, and whether to draw by blitting
+        #persistent artists instead of rebuilding the plot every tick
+        interval = kwargs.pop("interval", 750)
+        use_blit = kwargs.pop("blit", False)
+
+        #Initialize parent
+        MplCanvas.__init__(self, *args, **kwargs)
+        self.use_blit = use_blit
+
+        #Optional WaterfallCanvas fed with every new result
+        self.waterfall = None
+
+        if self.use_blit:
+            #Any full redraw, including ones Qt triggers on resize, refreshes
+            #the cached background
+            self.mpl_connect("draw_event", self.cache_background)
+
+        #Create dynamic canvas and start plotting, set timer for graph updates
+        timer = qtc.QTimer(self)
+        qtc.QObject.connect(timer,qtc.SIGNAL("timeout()"),self.update_figure)
+        timer.start(interval)
+
+    def start(self, alg):
+        """ Start computing alg on a background thread. The plot is set up
+            when its first result arrives. alg may also be a
+            pubsub.Subscriber, to show results computed elsewhere. """
+        self.alg = alg
+        #Algorithm and drawing stages share one set of timings
+        self.profiler = alg.profiler
+        #Live sources drop stale results, files are paced by the display.
+        #Algorithms without samples can still ask for pacing.
+        if not getattr(alg, "paced", alg.wavdata is not None):
+            self.worker = worker.AlgWorker(alg)
+        else:
+            self.worker = worker.AlgWorker(alg, depth=1, drop_oldest=False)
+        self.worker.start()
+
+    def compute_initial_figure(self, res):
+         """Initialize figure and set maximum X and maximum Y"""
+         self.res = res
+
+         #Get number of chans in order to set up toggle boxes
+         self.num_chans = len(res)
+         self.display_chans = [False for i in range(self.num_chans)]
+
+         #Find maximum value of all channels, excluding DC term ([1:])
+         max_max = max(map(lambda x: max(x[1:]), res))
+
+         #Find length of longest channel
+         self.x_max = max(map(len, res))
+
+         #1.05 is a cushion value so that we can see all of the data at
+         #farthest zoom out
+         self.y_max = 1.05*max_max
+
+         #Set zoom state to maximum zoom out
+         self.zoom["x"] = [0, self.x_max]
+         self.zoom["y"] = [0, self.y_max]
+         self.axes.set_xlim(self.zoom["x"][0], self.zoom["x"][1])
+         self.axes.set_ylim(self.zoom["y"][0], self.zoom["y"][1])
+
+         self.draw_figure(res)
+
+    def update_figure(self):
+        """ Plot the new data, and set zoom levels to current state values. """
+        #Get the newest result from the worker. If nothing new is ready, redraw
+        #the last one so zoom and cursor changes still show up
+        if self.worker is None:
+            return
+        results = self.worker.drain()
+        if self.res is None:
+            #Still starting up, set up the plot from the first result
+            if results:
+                self.compute_initial_figure(results[-1])
+            return
+        if results:
+            self.res = results[-1]
+
+        #The waterfall gets every result, not just the newest. It shows the
+        #first audio channel, whose detections from the last algorithm are
+        #nchannels from the end
+        if self.waterfall is not None:
+            det = -self.alg.nchannels
+            for res in results:
+                self.waterfall.add(res[0], res[det])
+            if results:
+                self.waterfall.update_figure()
+
+        #Plot new data using configured color scheme
+        self.draw_figure(self.res)
+
+def waterfall_clim(spectrum):
+    """ Color limits in dB, from the noise floor of spectrum up to its
+        peak """
+    return (waterfall.db(np.median(spectrum)), waterfall.db(max(spectrum[1:])))
+
+class WaterfallCanvas(FigureCanvas):
+    """ Scrolling spectrogram of the most recent spectra, newest at the top,
+        with detected bins highlighted. The image artist is created once and
+        only its data is replaced, and it is redrawn every every updates. """
+    def __init__(self, parent=None, bins=1024, rows=WATERFALL_ROWS, clim=(0, 100),
+                 width=5, height=4, dpi=100, every=WATERFALL_EVERY):
+        self.fig = Figure(figsize=(width, height), dpi=dpi, facecolor='w')
+        self.axes = self.fig.add_subplot(1,1,1)
+        self.history = waterfall.WaterfallBuffer(rows, bins)
+        self.every = every
+        self.updates = 0
+        #History shrunk to the height of the axes in pixels, see update_figure
+        self.step = None
+        self.shown = None
+
+        #Detections are written above the color limits, so they show in the
+        #colormap's "over" color
+        cmap = copy.copy(cm.jet)
+        cmap.set_over('w')
+        self.image = self.axes.imshow(self.history.view(), cmap=cmap, aspect="auto",
+                                      interpolation="nearest", origin="lower",
+                                      extent=(0, bins, -rows, 0),
+                                      vmin=clim[0], vmax=clim[1], animated=True)
+        self.axes.set_ylabel("frames ago")
+        FigureCanvas.__init__(self, self.fig)
+        self.setParent(parent)
+
+    def add(self, spectrum, detections=None):
+        """ Write one result into the history """
+        self.history.add(spectrum, detections)
+
+    def update_figure(self):
+        """ Blit the image with the current history over the axes """
+        self.updates += 1
+        if self.updates % self.every:
+            return
+        #Colormapping and resampling cost grows with the rows drawn, so no
+        #more rows are drawn than the axes have pixels
+        rows = self.history.rows
+        step = max(-(-rows // max(int(self.axes.bbox.height), 1)), 1)
+        if step != self.step:
+            self.step = step
+            self.shown = np.empty((rows//step, self.history.bins), dtype=self.history.buf.dtype)
+            self.image.set_extent((0, self.history.bins, -len(self.shown)*step, 0))
+            self.axes.set_ylim(-rows, 0)
+        self.image.set_data(self.history.pooled(step, self.shown))
+        self.axes.draw_artist(self.image)
+        self.blit(self.axes.bbox)
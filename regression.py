@@ -0,0 +1,186 @@
+#!/usr/bin/python
+""" Equivalence checks for the vectorized parts of the pipeline.
+
+    python regression.py
+    python regression.py --trials 2000 --seed 7
+
+ExampleAlg._alg is compared with the original per-bin loop on random
+spectra and random adjustable_params, and baseline.running_median with
+scipy.signal.medfilt row by row, both with bottleneck and with the
+np.partition fallback. Stores are recorded with every bin column type and
+read back, which must give finite values. Exits with a nonzero status if
+any check fails. Runs headless.
+"""
+
+import argparse
+import copy
+import os
+import random
+import shutil
+import sys
+import tempfile
+import warnings
+import wave
+import numpy as np
+from scipy.signal import medfilt
+import ExampleAlg
+import baseline
+import store
+
+TRIALS = 300
+
+
+def reference_alg(current_channel, params, fftlen=ExampleAlg.FFTLEN):
+    """ The original loop implementation of ExampleAlg._alg, for one
+        spectrum, with integer division where python 2 divided ints """
+    med_filt_width = params["med_filt_width"]
+    med_filt_width = med_filt_width if med_filt_width % 2 == 1 else med_filt_width+1
+    filtered = np.array(medfilt(current_channel, [med_filt_width]))
+    filtered = np.array(current_channel) - filtered
+    filtered = np.apply_along_axis(abs, 0, filtered)
+    enumerated = list(zip(range(len(filtered)),filtered))
+
+    peak_count = params["peak_count"]
+    peak_width_bins = params["peak_width_bins"]
+    chan_width_bins = params["chan_width_bins"]
+    peaks = []
+    for i in range(peak_count):
+        peak_bin = max(enumerated, key=lambda tup: tup[1])[0]
+        peaks.append(peak_bin)
+        lo = peak_bin-peak_width_bins//2 if peak_bin-peak_width_bins//2 >= 0 else 0
+        hi = peak_bin+peak_width_bins//2 if peak_bin-peak_width_bins//2 < len(enumerated) else len(enumerated)
+        enumerated = copy.deepcopy([(x,y) if x < lo or x > hi else (x,0) for x,y in enumerated])
+
+    without_peaks = np.array([tup[1] for tup in enumerated])
+    chan_stats = {}
+    for peak in peaks:
+        chan = without_peaks[peak+peak_width_bins//2:peak+chan_width_bins-peak_width_bins//2]
+        if len(chan) < 2:
+            continue
+        chan_stats[peak] = {}
+        zeroed = np.where(chan == 0)
+        chan[zeroed] = 1E5
+        local_min = 0
+        temp = max(chan)
+        for i, value in enumerate(chan):
+            local_min, temp = (i, value) if value < temp and i > 0 else (local_min, temp)
+        chan_stats[peak]["chan_min"] = int(peak+local_min)
+
+    out = [0]*len(current_channel)
+    lo = params["passband_start_bin"]
+    hi = params["passband_stop_bin"]
+    for k in chan_stats.keys():
+        idx = chan_stats[k]["chan_min"]
+        if idx > lo and idx < hi:
+            out[idx] = 1E7
+    return without_peaks, np.asarray(out, dtype=np.float64)
+
+def random_spectrum(rng, nbins):
+    """ Noise with a few tones, sometimes quantized so bins tie, sometimes
+        all zero """
+    kind = rng.randint(0, 4)
+    if kind == 0:
+        return np.zeros(nbins)
+    spectrum = np.abs(np.random.RandomState(rng.randint(0, 2**31)).randn(nbins))
+    for i in range(rng.randint(0, 20)):
+        spectrum[rng.randint(0, nbins-1)] += rng.uniform(1, 50)
+    if kind == 1:
+        spectrum = np.round(spectrum)
+    return spectrum
+
+def random_params(rng, alg):
+    return dict((key, rng.randint(param["min"], param["max"]))
+                for key, param in alg.adjustable_params.items())
+
+def write_wav(path, seconds=.1, framerate=20000):
+    w = wave.open(path, "wb")
+    w.setnchannels(1)
+    w.setsampwidth(2)
+    w.setframerate(framerate)
+    w.writeframes(np.zeros(int(seconds*framerate), dtype="<i2").tobytes())
+    w.close()
+
+def check_alg(wav_path, trials, seed):
+    """ ExampleAlg._alg against reference_alg. Returns a failure message,
+        or None. """
+    alg = ExampleAlg.ExampleAlg(wav_path)
+    rng = random.Random(seed)
+    nbins = alg.fftlen//2
+    for trial in range(trials):
+        spectrum = random_spectrum(rng, nbins)
+        params = random_params(rng, alg)
+        ref_without_peaks, ref_out = reference_alg(spectrum.copy(), params)
+        without_peaks, out = alg._alg(spectrum.copy(), None, params)
+        if not (np.array_equal(ref_without_peaks, without_peaks) and np.array_equal(ref_out, out)):
+            return "_alg differs from the loop in trial %d with %s" % (trial, sorted(params.items()))
+    return None
+
+def check_running_median(trials, seed):
+    """ baseline.running_median against medfilt on both of its code paths.
+        Returns a failure message, or None. """
+    paths = [("partition", None)]
+    if baseline.bottleneck is not None:
+        paths.insert(0, ("bottleneck", baseline.bottleneck))
+    rng = random.Random(seed)
+    saved = baseline.bottleneck, baseline.PARTITION_BLOCK
+    try:
+        for trial in range(trials):
+            nrows = rng.randint(1, 8)
+            nbins = rng.randint(1, 1100)
+            width = 2*rng.randint(0, 30) + 1
+            spectra = np.vstack([random_spectrum(rng, nbins) for i in range(nrows)])
+            with warnings.catch_warnings():
+                #Windows wider than the spectrum are part of the test
+                warnings.simplefilter("ignore")
+                expected = np.vstack([medfilt(row, [width]) for row in spectra])
+            for name, module in paths:
+                baseline.bottleneck = module
+                #Small blocks make the partition path split the rows
+                baseline.PARTITION_BLOCK = rng.choice([saved[1], nbins*width])
+                got = baseline.running_median(spectra, width)
+                if not np.array_equal(got, expected):
+                    return "%s running median differs from medfilt in trial %d, width %d" % (name, trial, width)
+    finally:
+        baseline.bottleneck, baseline.PARTITION_BLOCK = saved
+    return None
+
+def check_store(wav_path, tmpdir):
+    """ Record wav_path with each store.BIN_DTYPES type and check the bin
+        columns read back finite. Returns a failure message, or None. """
+    alg = ExampleAlg.ExampleAlg(wav_path)
+    #Mid range params leave channels wide enough to be filled with 1E5
+    for key, param in alg.adjustable_params.items():
+        alg.setParam(key, (param["min"] + param["max"]) // 2)
+    for spectrum_dtype in store.BIN_DTYPES:
+        path = os.path.join(tmpdir, spectrum_dtype + ".store")
+        store.record(alg, path, spectrum_dtype=spectrum_dtype)
+        stored = store.Store(path)
+        for name in ("spectrum", "without_peaks"):
+            if not np.isfinite(stored.read(name)).all():
+                return "%s %s column has values that are not finite" % (spectrum_dtype, name)
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the vectorized pipeline against reference implementations")
+    parser.add_argument("--trials", type=int, default=TRIALS, help="random cases per check")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        wav_path = os.path.join(tmpdir, "silence.wav")
+        write_wav(wav_path)
+        checks = [("alg", lambda: check_alg(wav_path, args.trials, args.seed)),
+                  ("baseline", lambda: check_running_median(args.trials, args.seed)),
+                  ("store", lambda: check_store(wav_path, tmpdir))]
+        failed = 0
+        for name, check in checks:
+            error = check()
+            print("%-10s %s" % (name, "ok" if error is None else "FAILED - " + error))
+            failed += error is not None
+    finally:
+        shutil.rmtree(tmpdir)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+import numpy as np
+import os
+import socket
+import sys
+import threading
+from itertools import cycle
+import wavio
+
+#Bytes read at a time by FileSource.preload
+PRELOAD_BLOCK = 4 * 2**20
+
+class RingBuffer(object):
+    """ Fixed size FIFO of equal length frames, preallocated as one
+        slots x frame_len array. When full, put() either overwrites the oldest
+        frame (drop_oldest=True, counted in self.dropped) or blocks until the
+        consumer makes room. """
+    def __init__(self, slots, frame_len, dtype, drop_oldest=True):
+        self.buf = np.zeros((slots, frame_len), dtype=dtype)
+        self.drop_oldest = drop_oldest
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return self.count
+
+    def put(self, frame):
+        """ Copy frame into the next free slot """
+        slots = len(self.buf)
+        with self.cond:
+            while self.count == slots and not self.drop_oldest and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return
+            if self.count == slots:
+                self.head = (self.head + 1) % slots
+                self.count -= 1
+                self.dropped += 1
+            self.buf[(self.head + self.count) % slots] = frame
+            self.count += 1
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        """ Remove and return a copy of the oldest frame. Returns None if the
+            buffer is closed and empty, or if timeout runs out first. """
+        with self.cond:
+            if self.count == 0 and not self.closed:
+                self.cond.wait(timeout)
+            if self.count == 0:
+                return None
+            frame = self.buf[self.head].copy()
+            self.head = (self.head + 1) % len(self.buf)
+            self.count -= 1
+            self.cond.notify_all()
+            return frame
+
+    def close(self):
+        """ Wake up any waiting producer or consumer. Frames already in the
+            buffer can still be read. """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class FileSource(object):
+    """ Loops over a WAV file forever, returning channels x frame_len
+        samples, scaled to [-1, 1), starting every hop samples. Only the
+        frame's samples are read from the memory mapped file, and frames
+        may be short at the end of the file. """
+    def __init__(self, wav_path, frame_len, hop=None):
+        self.path = wav_path
+        self.params, self.samples = wavio.read_wav(wav_path)
+        self.frame_len = frame_len
+        self.hop = frame_len if hop is None else hop
+        self.data_iter = cycle(range(0, self.params.nframes, self.hop))
+        self.dropped = 0
+        #Start sample of the last frame, which identifies it for caching
+        self.frame_id = None
+
+    def next_samples(self):
+        """ Unscaled channels x frame_len view of the next frame's samples,
+            straight out of the memory mapped file """
+        n = next(self.data_iter)
+        self.frame_id = n
+        return self.samples[:, n:n+self.frame_len]
+
+    def next_frame(self):
+        return wavio.scale(self.next_samples(), self.params.sampwidth)
+
+    def preload(self, progress=None):
+        """ Read through the whole file once, so frames later come out of
+            the page cache instead of off the disk. progress is called with
+            the fraction done after every block. Safe to run on another
+            thread while frames are being read. """
+        size = max(os.path.getsize(self.path), 1)
+        buf = bytearray(PRELOAD_BLOCK)
+        done = 0
+        with open(self.path, "rb") as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                done += n
+                if progress is not None:
+                    progress(float(done) / size)
+
+    def close(self):
+        pass
+
+
+class StreamSource(object):
+    """ Reads raw interleaved little endian PCM from a binary file object
+        (pipe, stdin, FIFO, socket) on a background thread into a RingBuffer
+        of hop sample blocks. Memory use is fixed by the number of slots,
+        however far the consumer falls behind. Frames come out as
+        nchannels x frame_len floats, like FileSource. """
+    def __init__(self, fileobj, frame_len, framerate, nchannels=1, dtype="<i2",
+                 slots=64, drop_oldest=True, hop=None):
+        dtype = np.dtype(dtype)
+        self.fileobj = fileobj
+        self.frame_len = frame_len
+        self.hop = frame_len if hop is None else hop
+        self.params = wavio.WavParams(nchannels, dtype.itemsize, framerate, 0,
+                                      "NONE", "not compressed")
+        #Each slot holds hop interleaved samples of every channel
+        self.ring = RingBuffer(slots, self.hop*nchannels, dtype, drop_oldest)
+        #Overlapping frames are assembled from the last frame_len samples
+        self.frame = np.zeros((nchannels, frame_len))
+        #Live frames never repeat, so they are never cached
+        self.frame_id = None
+        self.reader = threading.Thread(target=self._fill)
+        self.reader.daemon = True
+        self.reader.start()
+
+    @property
+    def dropped(self):
+        """ Number of frames overwritten before they were consumed """
+        return self.ring.dropped
+
+    def _fill(self):
+        frame = np.empty(self.ring.buf.shape[1], dtype=self.ring.buf.dtype)
+        view = memoryview(frame.view(np.uint8))
+        try:
+            while not self.ring.closed:
+                got = 0
+                while got < len(view):
+                    n = self.fileobj.readinto(view[got:])
+                    if not n:
+                        return
+                    got += n
+                self.ring.put(frame)
+        except (IOError, OSError, ValueError):
+            #Stream was closed underneath the reader
+            pass
+        finally:
+            self.ring.close()
+
+    def next_frame(self, timeout=None):
+        """ Block until a full frame has arrived and return it, or None if
+            timeout runs out first. """
+        block = self.ring.get(timeout)
+        if block is None:
+            if self.ring.closed:
+                raise EOFError("Stream source is closed")
+            return None
+        hop = self.hop
+        nchannels, sampwidth = self.params[:2]
+        block = wavio.scale(block.reshape(hop, nchannels).T, sampwidth)
+        if hop >= self.frame_len:
+            return block[:, :self.frame_len]
+        self.frame[:, :-hop] = self.frame[:, hop:]
+        self.frame[:, -hop:] = block
+        return self.frame.copy()
+
+    def close(self):
+        self.ring.close()
+        self.fileobj.close()
+
+
+class SocketSource(StreamSource):
+    """ StreamSource reading from a connected local socket. address is a
+        path for a Unix socket, or a (host, port) tuple for TCP. """
+    def __init__(self, address, *args, **kwargs):
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        StreamSource.__init__(self, self.sock.makefile("rb"), *args, **kwargs)
+
+    def close(self):
+        StreamSource.close(self)
+        self.sock.close()
+
+
+def parse_address(spec):
+    """ Socket address of "unix:PATH" (a path) or "tcp:HOST:PORT" (a
+        (host, port) tuple), or None for anything else """
+    if spec.startswith("unix:"):
+        return spec[len("unix:"):]
+    if spec.startswith("tcp:"):
+        host, port = spec[len("tcp:"):].rsplit(":", 1)
+        return (host, int(port))
+    return None
+
+def open_stream(spec, *args, **kwargs):
+    """ Open a raw PCM stream source from a string description - "-" for
+        stdin, "unix:PATH" or "tcp:HOST:PORT" for sockets, anything else is
+        the path of a FIFO or file. Remaining arguments go to StreamSource. """
+    if spec == "-":
+        return StreamSource(getattr(sys.stdin, "buffer", sys.stdin), *args, **kwargs)
+    address = parse_address(spec)
+    if address is not None:
+        return SocketSource(address, *args, **kwargs)
+    return StreamSource(open(spec, "rb"), *args, **kwargs)
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+""" Append-only columnar store of per-frame ExampleAlg results.
+
+    python store.py capture.wav capture.store -p peak_count=8 --spectrum uint8
+
+A store is a directory with a meta.json and one subdirectory per column.
+Each column is split into chunks of CHUNK_ROWS frames, saved as .npy files,
+so any range of frames is read through memory maps without loading the rest.
+Columns are the frame start sample, the spectrum and without_peaks (float32,
+float16, or uint8 quantized dB), and per peak the chan_min bin (-1 where
+the channel was too small), whether it was detected, and the channel mean
+and variance. without_peaks has its zero channel bins filled with 1E5, which
+float16 columns clip to 65504 and uint8 columns to about 3.6E3, the top of
+the quantized range. ReplaySource plays a store back in the GUI in place of an
+algorithm.
+"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+import numpy as np
+import ExampleAlg
+import instrument
+import waterfall
+
+#Frames per chunk file
+CHUNK_ROWS = 4096
+#Storage types for the spectrum and without_peaks columns
+BIN_DTYPES = ("float32", "float16", "uint8")
+#uint8 columns hold dB in QUANT_DB_STEP steps from QUANT_DB_MIN, which covers
+#-120 dB to +71 dB relative to a full scale sample
+QUANT_DB_MIN = -120.
+QUANT_DB_STEP = .75
+#Value of out at detected bins, as in ExampleAlg
+DETECTION = 1E7
+
+
+def quantize(values):
+    """ Magnitudes to uint8 dB codes """
+    codes = np.round((waterfall.db(values) - QUANT_DB_MIN) / QUANT_DB_STEP)
+    return np.clip(codes, 0, 255).astype(np.uint8)
+
+def encode_bins(values, spectrum_dtype):
+    """ Magnitudes to a spectrum_dtype bin column. Values past the largest
+        float16 are clipped, so they are stored finite. """
+    if spectrum_dtype == "uint8":
+        return quantize(values)
+    if spectrum_dtype == "float16":
+        return np.minimum(values, np.finfo(np.float16).max).astype(np.float16)
+    return values
+
+def dequantize(codes):
+    """ uint8 dB codes back to magnitudes """
+    db = np.asarray(codes, dtype=np.float64) * QUANT_DB_STEP + QUANT_DB_MIN
+    return np.maximum(10**(db/20.) - waterfall.FLOOR, 0)
+
+
+class StoreWriter(object):
+    """ Appends rows to the store at path, creating it from columns, an
+        ordered mapping of name to (dtype, row shape), if it does not exist.
+        Rows are kept in memory until a chunk fills or flush() is called,
+        and existing stores are appended to. Appending with columns or
+        attrs other than the store's raises ValueError. """
+    def __init__(self, path, columns=None, chunk_rows=CHUNK_ROWS, attrs=None):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if columns is not None:
+            columns = collections.OrderedDict(
+                (name, {"dtype": np.dtype(dtype).str, "shape": list(shape)})
+                for name, (dtype, shape) in columns.items())
+        #Compared with the stored attrs as they come back from JSON
+        attrs = json.loads(json.dumps(attrs or {}), object_pairs_hook=collections.OrderedDict)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f, object_pairs_hook=collections.OrderedDict)
+            self._checkMeta(columns, attrs)
+        else:
+            if columns is None:
+                raise ValueError("A new store needs its columns")
+            self.meta = collections.OrderedDict()
+            self.meta["chunk_rows"] = chunk_rows
+            self.meta["rows"] = 0
+            self.meta["columns"] = columns
+            self.meta["attrs"] = attrs
+            for name in self.meta["columns"]:
+                os.makedirs(os.path.join(path, name))
+        chunk_rows = self.meta["chunk_rows"]
+        self.buffers = collections.OrderedDict(
+            (name, np.empty([chunk_rows] + col["shape"], dtype=col["dtype"]))
+            for name, col in self.meta["columns"].items())
+        #Rows of the last, partial chunk are loaded back so appends go on
+        #filling it
+        self.fill = self.meta["rows"] % chunk_rows
+        if self.fill:
+            chunk = self.meta["rows"] // chunk_rows
+            for name, buf in self.buffers.items():
+                buf[:self.fill] = np.load(self._chunkPath(name, chunk))
+        self._writeMeta()
+
+    def _checkMeta(self, columns, attrs):
+        """ Refuse to append rows that do not match the existing store """
+        if columns is not None and columns != self.meta["columns"]:
+            names = sorted(set(columns) ^ set(self.meta["columns"]) |
+                           set(k for k in columns if columns[k] != self.meta["columns"].get(k, columns[k])))
+            raise ValueError("Store " + self.path + " has different columns, differing in " +
+                             ", ".join(names))
+        stored = self.meta["attrs"]
+        if attrs and attrs != stored:
+            names = sorted(k for k in set(attrs) | set(stored) if attrs.get(k) != stored.get(k))
+            raise ValueError("Store " + self.path + " was recorded with different " +
+                             ", ".join(names) + " - append to a new store instead")
+
+    def _chunkPath(self, name, chunk):
+        return os.path.join(self.path, name, "%06d.npy" % chunk)
+
+    def _writeMeta(self):
+        #Replace rather than rewrite, so readers never see half a file
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f, indent=1)
+        try:
+            os.replace(tmp, os.path.join(self.path, "meta.json"))
+        except AttributeError:  # python2.x
+            os.rename(tmp, os.path.join(self.path, "meta.json"))
+
+    def __len__(self):
+        return self.meta["rows"] - (self.meta["rows"] % self.meta["chunk_rows"]) + self.fill
+
+    def append(self, **columns):
+        """ Append rows given as one array per column, frames first """
+        nrows = len(next(iter(columns.values())))
+        chunk_rows = self.meta["chunk_rows"]
+        done = 0
+        while done < nrows:
+            n = min(nrows - done, chunk_rows - self.fill)
+            for name, buf in self.buffers.items():
+                buf[self.fill:self.fill+n] = columns[name][done:done+n]
+            self.fill += n
+            done += n
+            if self.fill == chunk_rows:
+                self.flush()
+
+    def flush(self):
+        """ Write the rows appended so far to disk """
+        chunk_rows = self.meta["chunk_rows"]
+        chunk = self.meta["rows"] // chunk_rows
+        if self.fill == 0:
+            return
+        for name, buf in self.buffers.items():
+            np.save(self._chunkPath(name, chunk), buf[:self.fill])
+        self.meta["rows"] = chunk*chunk_rows + self.fill
+        if self.fill == chunk_rows:
+            self.fill = 0
+        self._writeMeta()
+
+    def close(self):
+        self.flush()
+
+
+class Store(object):
+    """ Read only access to a store. Chunks are memory mapped when first
+        used, and uint8 bin columns are decoded back to magnitudes. """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f, object_pairs_hook=collections.OrderedDict)
+        self.columns = list(self.meta["columns"])
+        self.attrs = self.meta["attrs"]
+        self.chunks = {}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def _chunk(self, name, chunk):
+        key = (name, chunk)
+        if key not in self.chunks:
+            path = os.path.join(self.path, name, "%06d.npy" % chunk)
+            self.chunks[key] = np.load(path, mmap_mode="r")
+        return self.chunks[key]
+
+    def read(self, name, start=0, stop=None, raw=False):
+        """ Rows start to stop of column name. Unless raw, quantized columns
+            are decoded. """
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, min(start, stop))
+        chunk_rows = self.meta["chunk_rows"]
+        parts = []
+        i = start
+        while i < stop:
+            chunk, offset = divmod(i, chunk_rows)
+            n = min(stop - i, chunk_rows - offset)
+            parts.append(self._chunk(name, chunk)[offset:offset+n])
+            i += n
+        col = self.meta["columns"][name]
+        if parts:
+            rows = np.concatenate(parts)
+        else:
+            rows = np.empty([0] + col["shape"], dtype=col["dtype"])
+        if not raw and name in ("spectrum", "without_peaks") and rows.dtype == np.uint8:
+            return dequantize(rows)
+        return rows
+
+    def out(self, start=0, stop=None):
+        """ Rebuild ExampleAlg's out channel for rows start to stop from
+            the detected chan_min bins """
+        chan_min = self.read("chan_min", start, stop)
+        detected = self.read("detected", start, stop)
+        out = np.zeros(chan_min.shape[:-1] + (self.attrs["bins"],))
+        idx = np.nonzero(detected)
+        out[idx[:-1] + (chan_min[idx],)] = DETECTION
+        return out
+
+
+def store_columns(alg, spectrum_dtype="float32"):
+    """ Column layout for results of alg, with peaks padded to the most
+        peak_count allows """
+    if spectrum_dtype not in BIN_DTYPES:
+        raise ValueError("Unknown spectrum type " + str(spectrum_dtype) + ", expected one of " + ", ".join(BIN_DTYPES))
+    chans = [alg.nchannels] if alg.nchannels > 1 else []
+    bins = chans + [alg.fftlen//2]
+    peaks = chans + [alg.adjustable_params["peak_count"]["max"]]
+    columns = collections.OrderedDict()
+    columns["frame_start"] = (np.int64, [])
+    columns["spectrum"] = (spectrum_dtype, bins)
+    columns["without_peaks"] = (spectrum_dtype, bins)
+    columns["chan_min"] = (np.int32, peaks)
+    columns["detected"] = (bool, peaks)
+    columns["chan_mean"] = (np.float32, peaks)
+    columns["chan_var"] = (np.float32, peaks)
+    return columns
+
+def record(alg, path, start=0, stop=None, frames_per_chunk=CHUNK_ROWS,
+           spectrum_dtype="float32"):
+    """ Run frames start to stop of alg's file through ExampleAlg.batch and
+        append the results to the store at path """
+    columns = store_columns(alg, spectrum_dtype)
+    attrs = {"params": alg.getParams(), "nchannels": alg.nchannels,
+             "framerate": alg.framerate, "fftlen": alg.fftlen,
+             "bins": alg.fftlen//2, "hop": alg.hop, "frame_len": alg.frame_len}
+    writer = StoreWriter(path, columns, attrs=attrs)
+    stop = alg.frameCount() if stop is None else min(stop, alg.frameCount())
+    max_peaks = columns["chan_min"][1][-1]
+    for i in range(start, stop, frames_per_chunk):
+        table = alg.batch(start=i, stop=min(i+frames_per_chunk, stop), details=True)
+        rows = {"frame_start": table["frame_start"]}
+        for name in ("spectrum", "without_peaks"):
+            rows[name] = encode_bins(table[name], spectrum_dtype)
+        #Peaks past peak_count, and invalid channels, are left as -1/NaN
+        pad = [(0, 0)] * (table["chan_min"].ndim-1) + [(0, max_peaks - table["chan_min"].shape[-1])]
+        valid = table["valid"]
+        rows["chan_min"] = np.pad(np.where(valid, table["chan_min"], -1), pad, "constant", constant_values=-1)
+        rows["detected"] = np.pad(table["detected"], pad, "constant")
+        for name in ("chan_mean", "chan_var"):
+            rows[name] = np.pad(np.where(valid, table[name], np.nan), pad, "constant", constant_values=np.nan)
+        writer.append(**rows)
+    writer.close()
+    return writer
+
+
+class ReplaySource(object):
+    """ Plays a store back through DynamicMplCanvas in place of an
+        algorithm. run() returns the stored spectrum, without_peaks and out
+        channels of the next frame. speed frames are skipped forward per
+        call, and seek() jumps to any frame. Playback loops at the end. """
+    #No samples, but paced by the display like a file
+    wavdata = None
+    paced = True
+
+    def __init__(self, path):
+        self.store = Store(path)
+        self.nchannels = self.store.attrs.get("nchannels", 1)
+        self.algorithms = collections.OrderedDict()
+        self.profiler = instrument.Profiler()
+        self.position = 0
+        self.speed = 1
+        self.lock = threading.Lock()
+
+    def frameCount(self):
+        return len(self.store)
+
+    def channelNames(self):
+        return ExampleAlg.channel_names(("spectrum",) + ExampleAlg.ExampleAlg.OUTPUTS,
+                                        self.nchannels)
+
+    def seek(self, frame):
+        """ Continue playback from frame """
+        with self.lock:
+            self.position = int(frame) % max(len(self.store), 1)
+
+    def setSpeed(self, speed):
+        """ Frames to advance per result, 1 for normal playback """
+        with self.lock:
+            self.speed = max(int(speed), 1)
+
+    def run(self):
+        if len(self.store) == 0:
+            raise EOFError("Store is empty")
+        with self.lock:
+            i = self.position
+            self.position = (i + self.speed) % len(self.store)
+        with self.profiler.stage("replay"):
+            out = []
+            for name in ("spectrum", "without_peaks"):
+                out.extend(np.atleast_2d(self.store.read(name, i, i+1)[0]))
+            out.extend(np.atleast_2d(self.store.out(i, i+1)[0]))
+        self.profiler.end_frame()
+        return out
+
+
+def main(argv=None):
+    import analyze
+    parser = argparse.ArgumentParser(description="Record ExampleAlg results for a WAV file into a store")
+    parser.add_argument("wav", help="WAV file to analyze")
+    parser.add_argument("store", help="store directory, appended to if it exists")
+    parser.add_argument("--start", type=int, default=0, help="first frame")
+    parser.add_argument("--stop", type=int, default=None, help="frame to stop before")
+    parser.add_argument("--spectrum", choices=BIN_DTYPES, default="float32",
+                        help="storage type of the spectrum and without_peaks columns, float16 and uint8 clip large values")
+    parser.add_argument("--frame-len", type=int, default=ExampleAlg.FRAME_LEN, help="samples per frame")
+    parser.add_argument("--hop", type=int, default=None, help="samples between frame starts, default frame-len")
+    parser.add_argument("--fftlen", type=int, default=ExampleAlg.FFTLEN, help="FFT length")
+    parser.add_argument("-p", "--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="adjustable parameter value, may be repeated")
+    args = parser.parse_args(argv)
+
+    alg = ExampleAlg.ExampleAlg(args.wav, frame_len=args.frame_len, hop=args.hop, fftlen=args.fftlen)
+    for key, value in analyze.parse_params(args.param).items():
+        alg.setParam(key, value)
+    writer = record(alg, args.store, args.start, args.stop, spectrum_dtype=args.spectrum)
+    print("Wrote %d frames to %s" % (len(writer), args.store))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
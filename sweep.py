@@ -0,0 +1,223 @@
+#!/usr/bin/python
+""" Parameter sweep of ExampleAlg over WAV files.
+
+    python sweep.py -o sweep.csv --steps 4 -g peak_count=1,4,8 recordings/
+
+Every combination of values of the adjustable_params is run over every
+frame of every file. By default each parameter takes --steps values spread
+evenly from its min to its max; -g gives a parameter explicit values, as a
+comma separated list or start:stop:step, and -p fixes one. Spectra are
+computed once per file, as float32, and shared with a pool of worker
+processes through a memory mapped file. Files are swept one at a time.
+Combinations are grouped by med_filt_width, so each worker computes the
+baseline of a block of frames once for all of its combinations. One CSV
+row per file and combination is appended as soon as its task finishes, and
+rerunning with the same output skips the rows that are already there, so
+an interrupted sweep picks up where it stopped.
+"""
+
+import argparse
+import collections
+import csv
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import ExampleAlg
+import analyze
+import baseline
+import framing
+
+#Frames per block of spectra processed at once by a worker
+BLOCK_FRAMES = 1024
+#Most combinations handed to one worker task
+COMBOS_PER_TASK = 16
+METRICS = ("frames", "detections", "per_frame_mean", "per_frame_std",
+           "frames_detected", "persistence")
+
+
+class SweepMetrics(object):
+    """ Running detection counts and stability of one combination over
+        consecutive blocks of frames x channels x bins detections """
+    def __init__(self):
+        self.frames = 0
+        self.detections = 0
+        self.sumsq = 0
+        self.frames_detected = 0
+        self.repeated = 0
+        self.prev = None
+
+    def add(self, hits):
+        counts = hits.reshape(len(hits), -1).sum(axis=1)
+        self.frames += len(hits)
+        self.detections += int(counts.sum())
+        self.sumsq += int((counts**2).sum())
+        self.frames_detected += int((counts > 0).sum())
+        #Detections also present at the same bin in the frame before
+        if len(hits):
+            prev = hits[:-1] if self.prev is None else np.concatenate([self.prev[None], hits[:-1]])
+            later = hits if self.prev is not None else hits[1:]
+            self.repeated += int((prev & later).sum())
+            self.prev = hits[-1]
+
+    def result(self):
+        res = collections.OrderedDict()
+        frames = max(self.frames, 1)
+        mean = self.detections / float(frames)
+        res["frames"] = self.frames
+        res["detections"] = self.detections
+        res["per_frame_mean"] = mean
+        res["per_frame_std"] = np.sqrt(max(self.sumsq / float(frames) - mean**2, 0))
+        res["frames_detected"] = self.frames_detected / float(frames)
+        res["persistence"] = self.repeated / float(max(self.detections, 1))
+        return res
+
+
+def value_range(param, steps):
+    """ steps ints spread evenly over a parameter's min to max """
+    values = np.linspace(param["min"], param["max"], max(steps, 1))
+    return sorted(set(int(round(v)) for v in values))
+
+def parse_values(spec):
+    """ "a,b,c" or "start:stop:step" to a list of ints """
+    if ":" in spec:
+        start, stop, step = (list(map(int, spec.split(":"))) + [1])[:3]
+        return list(range(start, stop+1, step))
+    return [int(v) for v in spec.split(",")]
+
+def param_grid(adjustable_params, steps, grids={}, fixed={}):
+    """ Every combination of parameter values, as ordered dicts """
+    axes = collections.OrderedDict()
+    for key, param in adjustable_params.items():
+        if key in fixed:
+            axes[key] = [fixed[key]]
+        elif key in grids:
+            axes[key] = grids[key]
+        else:
+            axes[key] = value_range(param, steps)
+    return [collections.OrderedDict(zip(axes, values)) for values in itertools.product(*axes.values())]
+
+def effective_width(med_filt_width):
+    #Even widths run as the next odd width, so they share a baseline
+    return med_filt_width if med_filt_width % 2 == 1 else med_filt_width+1
+
+def write_spectra(alg, path, frames_per_chunk=256):
+    """ Spectra of every frame of alg's file to a float32 .npy file, frames
+        x channels rows by bins """
+    nframes = alg.frameCount()
+    spectra = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32,
+                                        shape=(nframes*alg.nchannels, alg.fftlen//2))
+    for i in range(0, nframes, frames_per_chunk):
+        j = min(i+frames_per_chunk, nframes)
+        spectra[i*alg.nchannels:j*alg.nchannels] = alg.spectraRange(i, j)
+    spectra.flush()
+    del spectra
+
+def sweep_task(wav_path, spectra_path, combos, framing_args={}, block_frames=BLOCK_FRAMES):
+    """ Metrics of every combination, which all share one med_filt_width,
+        over the precomputed spectra of wav_path """
+    alg = ExampleAlg.ExampleAlg(wav_path, **framing_args)
+    spectra = np.load(spectra_path, mmap_mode="r")
+    nchannels = alg.nchannels
+    metrics = [SweepMetrics() for combo in combos]
+    width = effective_width(combos[0]["med_filt_width"])
+    rows = block_frames * nchannels
+    for start in range(0, len(spectra), rows):
+        block = np.asarray(spectra[start:start+rows], dtype=np.float64)
+        #Computed once per block for every combination, whatever its size
+        floor = baseline.baseline(block, width, alg.baseline_method)
+        for combo, m in zip(combos, metrics):
+            res = alg._detect(block, None, combo, floor)
+            m.add(res["out"].reshape(-1, nchannels, block.shape[-1]) > 0)
+    return [(combo, m.result()) for combo, m in zip(combos, metrics)]
+
+def read_done(out_path):
+    """ Keys of the rows already in an earlier sweep's output """
+    done = set()
+    if os.path.exists(out_path):
+        with open(out_path) as f:
+            for row in csv.DictReader(f):
+                done.add(row_key(row["file"], row, [k for k in row if k not in METRICS and k != "file"]))
+    return done
+
+def row_key(wav_path, params, keys):
+    return (os.path.abspath(wav_path),) + tuple(int(params[k]) for k in keys)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep ExampleAlg's adjustable_params over WAV files")
+    parser.add_argument("paths", nargs="+", help="WAV files, or directories to search for them")
+    parser.add_argument("-o", "--output", default="sweep.csv", help="CSV table, appended to if it exists")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, default one per core")
+    parser.add_argument("--steps", type=int, default=3, help="values per parameter from its min to its max")
+    parser.add_argument("-g", "--grid", action="append", default=[], metavar="NAME=VALUES",
+                        help="values of one parameter, a,b,c or start:stop:step")
+    parser.add_argument("-p", "--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="fix one of ExampleAlg's adjustable_params")
+    parser.add_argument("--frame-len", type=int, default=ExampleAlg.FRAME_LEN, help="samples per frame")
+    parser.add_argument("--hop", type=int, default=None, help="samples between frame starts, default frame-len")
+    parser.add_argument("--fftlen", type=int, default=ExampleAlg.FFTLEN, help="FFT length")
+    parser.add_argument("--window", default=ExampleAlg.WINDOW, choices=sorted(framing.WINDOWS),
+                        help="window function")
+    parser.add_argument("--baseline", default=ExampleAlg.BASELINE, choices=sorted(baseline.METHODS),
+                        help="noise floor estimator")
+    args = parser.parse_args(argv)
+    framing_args = {"frame_len": args.frame_len, "hop": args.hop,
+                    "fftlen": args.fftlen, "window": args.window,
+                    "baseline_method": args.baseline}
+    grids = dict((k, parse_values(v)) for k, v in
+                 (pair.partition("=")[::2] for pair in args.grid))
+    fixed = analyze.parse_params(args.param)
+
+    done = read_done(args.output)
+    new_file = not os.path.exists(args.output)
+    out = open(args.output, "a")
+    writer = None
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            #One file at a time, so its rows are on disk and its spectra
+            #deleted before the next file's spectra are computed
+            for wav_path in analyze.find_wavs(args.paths):
+                alg = ExampleAlg.ExampleAlg(wav_path, **framing_args)
+                combos = param_grid(alg.adjustable_params, args.steps, grids, fixed)
+                keys = list(combos[0].keys())
+                combos = [c for c in combos if row_key(wav_path, c, keys) not in done]
+                if not combos:
+                    continue
+                if writer is None:
+                    writer = csv.DictWriter(out, ["file"] + keys + list(METRICS))
+                    if new_file:
+                        writer.writeheader()
+                spectra_path = os.path.join(tmpdir, "spectra.npy")
+                write_spectra(alg, spectra_path)
+
+                by_width = collections.defaultdict(list)
+                for combo in combos:
+                    by_width[effective_width(combo["med_filt_width"])].append(combo)
+                pending = []
+                for width, group in sorted(by_width.items()):
+                    for i in range(0, len(group), COMBOS_PER_TASK):
+                        pending.append(pool.submit(sweep_task, wav_path, spectra_path,
+                                                   group[i:i+COMBOS_PER_TASK], framing_args))
+
+                for n, fut in enumerate(as_completed(pending)):
+                    for combo, metrics in fut.result():
+                        row = collections.OrderedDict(file=os.path.abspath(wav_path))
+                        row.update(combo)
+                        row.update(metrics)
+                        writer.writerow(row)
+                    #Every finished task is on disk before the next one is
+                    #waited for
+                    out.flush()
+                    print("%s %d/%d" % (wav_path, n+1, len(pending)))
+                os.remove(spectra_path)
+    finally:
+        out.close()
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
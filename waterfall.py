@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+import numpy as np
+
+#Value written over detected bins. It is above any spectrum level in dB, so
+#it shows in the colormap's "over" color.
+DETECTION = 1E9
+#Magnitude added before taking logs so empty bins stay finite, -120 dB
+#relative to a full scale sample
+FLOOR = 1E-6
+
+
+def db(values):
+    """ Magnitudes in dB, with FLOOR as the lowest level """
+    return 20*np.log10(np.asarray(values) + FLOOR)
+
+
+class WaterfallBuffer(object):
+    """ History of the last rows spectra, in dB, preallocated as a circular
+        rows x bins image. Every row is stored twice, rows apart, so the
+        history in time order is always one contiguous view of the buffer and
+        never has to be copied or rolled. """
+    def __init__(self, rows, bins, dtype=np.float32):
+        self.rows = rows
+        self.bins = bins
+        self.buf = np.empty((2*rows, bins), dtype=dtype)
+        self.buf.fill(db(0))
+        self.head = 0
+        self.written = 0
+
+    def add(self, spectrum, detections=None):
+        """ Write spectrum, marking bins where detections is nonzero, over
+            the oldest row """
+        row = self.buf[self.head]
+        n = min(len(spectrum), self.bins)
+        np.add(spectrum[:n], FLOOR, out=row[:n])
+        np.log10(row[:n], out=row[:n])
+        row[:n] *= 20
+        if detections is not None:
+            row[:n][np.asarray(detections[:n]) > 0] = DETECTION
+        self.buf[self.head+self.rows] = row
+        self.head = (self.head + 1) % self.rows
+        self.written += 1
+
+    def view(self):
+        """ rows x bins view of the history, oldest row first """
+        return self.buf[self.head:self.head+self.rows]
+
+    def pooled(self, step, out=None):
+        """ The history shrunk to rows//step rows, each the maximum of step
+            consecutive rows so peaks and detections are kept. The oldest
+            rows%step rows are left out. Written into out if given. """
+        n = self.rows // step
+        history = self.view()[self.rows - n*step:]
+        return history.reshape(n, step, self.bins).max(axis=1, out=out)
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+import numpy as np
+import collections
+import struct
+import os
+
+#Same field order as the tuple returned by wave.getparams()
+WavParams = collections.namedtuple("WavParams",
+                                   "nchannels sampwidth framerate nframes comptype compname")
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+#Sample dtypes by sample width in bytes. 8 bit WAV data is unsigned, wider
+#integer data is signed little endian. 24 bit samples have no numpy dtype and
+#are handled by Int24Samples.
+PCM_DTYPES = {1: np.dtype("u1"),
+              2: np.dtype("<i2"),
+              4: np.dtype("<i4")}
+FLOAT_DTYPES = {4: np.dtype("<f4"),
+                8: np.dtype("<f8")}
+
+
+class Int24Samples(object):
+    """ Read only channels x samples array of packed 24 bit samples on top
+        of a byte memmap of interleaved data. Slicing returns a new int32
+        array holding only the requested samples, so a frame can be read
+        without converting the whole file. """
+    def __init__(self, raw, nchannels=1):
+        self.raw = raw.reshape(-1, nchannels, 3).transpose(1, 0, 2)
+        self.dtype = np.dtype("<i4")
+
+    def __len__(self):
+        return len(self.raw)
+
+    @property
+    def shape(self):
+        return self.raw.shape[:-1]
+
+    def __getitem__(self, key):
+        raw = self.raw[key]
+        out = (raw[..., 0].astype(np.int32) |
+               (raw[..., 1].astype(np.int32) << 8) |
+               (raw[..., 2].astype(np.int8).astype(np.int32) << 16))
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+
+def _read_chunks(f):
+    """ Yield (chunk_id, offset of chunk data, chunk size) for every chunk in
+        a RIFF/WAVE file. """
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return
+        chunk_id, size = struct.unpack("<4sI", chunk)
+        offset = f.tell()
+        yield chunk_id, offset, size
+        #Chunks are word aligned
+        f.seek(offset + size + (size & 1))
+
+def scale(samples, sampwidth):
+    """ Convert integer samples of sampwidth bytes to floats in [-1, 1).
+        8 bit samples are unsigned around 128, wider ones are signed. Float
+        samples are returned as float64 unchanged. """
+    samples = np.asarray(samples)
+    if samples.dtype.kind == "f":
+        return samples.astype(np.float64)
+    full_scale = float(2**(8*sampwidth-1))
+    if samples.dtype.kind == "u":
+        return (samples - full_scale) / full_scale
+    return samples / full_scale
+
+def scale_into(samples, sampwidth, out):
+    """ scale() written into the preallocated float array out, which must
+        have the shape of samples, without any temporary arrays """
+    samples = np.asarray(samples)
+    if samples.dtype.kind == "f":
+        np.copyto(out, samples, casting="unsafe")
+        return out
+    full_scale = float(2**(8*sampwidth-1))
+    #Cast first, converting inside the ufuncs would need buffers
+    np.copyto(out, samples, casting="unsafe")
+    if samples.dtype.kind == "u":
+        np.subtract(out, out.dtype.type(full_scale), out=out)
+    np.multiply(out, out.dtype.type(1 / full_scale), out=out)
+    return out
+
+def read_wav(wav_path):
+    """ Open a PCM WAV file without reading its sample data. Returns
+        (params, samples), where samples is a channels x samples read only
+        view of the interleaved data chunk of the file, memory mapped. Use
+        scale() to turn slices of it into floats. """
+    fmt = None
+    data = None
+    with open(wav_path, "rb") as f:
+        for chunk_id, offset, size in _read_chunks(f):
+            if chunk_id == b"fmt ":
+                f.seek(offset)
+                fmt = f.read(min(size, 40))
+            elif chunk_id == b"data":
+                data = (offset, size)
+                break
+    if fmt is None or data is None:
+        raise ValueError("WAV file is missing its fmt or data chunk")
+
+    format_tag, nchannels, framerate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    sampwidth = (bits + 7) // 8
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        #Extensible files keep the actual format tag in the first two bytes
+        #of the sub format GUID
+        format_tag = struct.unpack("<H", fmt[24:26])[0]
+    if format_tag == WAVE_FORMAT_PCM and sampwidth in (1, 2, 3, 4):
+        dtype = PCM_DTYPES.get(sampwidth, np.dtype("u1"))
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT and sampwidth in FLOAT_DTYPES:
+        dtype = FLOAT_DTYPES[sampwidth]
+    else:
+        raise ValueError("Unsupported WAV format %d with %d bit samples" % (format_tag, bits))
+
+    #Truncated files report a data size past the end of the file
+    offset, size = data
+    size = min(size, os.path.getsize(wav_path) - offset)
+    nframes = size // block_align
+    nbytes = nframes * nchannels * sampwidth
+    if nbytes == 0:
+        raw = np.zeros(0, dtype=dtype)
+    else:
+        raw = np.memmap(wav_path, dtype=dtype, mode="r", offset=offset,
+                        shape=(nbytes // dtype.itemsize,))
+    #De-interleave by striding, without copying
+    if sampwidth == 3:
+        samples = Int24Samples(raw, nchannels)
+    else:
+        samples = raw.reshape(nframes, nchannels).T
+    params = WavParams(nchannels, sampwidth, framerate, nframes, "NONE", "not compressed")
+    return params, samples
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+import sys
+import threading
+import traceback
+try:
+    import queue
+except ImportError:  # python2.x
+    import Queue as queue
+
+
+class AlgWorker(threading.Thread):
+    """ Calls alg.run() continuously on a background thread and keeps the
+        most recent results in a bounded queue. When the consumer falls
+        behind, the oldest result is thrown away and counted in skipped, so
+        the consumer always sees fresh data. With drop_oldest=False the
+        worker waits for room in the queue instead, which paces playback of
+        files to the consumer. A frame that raises is counted in errors and
+        its exception kept in error, and the worker carries on with the next
+        frame. """
+    def __init__(self, alg, depth=4, drop_oldest=True):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.alg = alg
+        self.results = queue.Queue(depth)
+        self.drop_oldest = drop_oldest
+        self.produced = 0
+        self.skipped = 0
+        self.skipped_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.errors = 0
+        self.error = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                res = self.alg.run()
+            except EOFError:
+                #Stream sources run dry eventually
+                break
+            except Exception as e:
+                #Report the first of a run of identical errors, and back off
+                #so a bad parameter value does not spin the thread
+                message = type(e).__name__ + ": " + str(e)
+                if message != self.error:
+                    traceback.print_exc(file=sys.stderr)
+                self.error = message
+                self.errors += 1
+                self.stopped.wait(.1)
+                continue
+            self.error = None
+            self.produced += 1
+            while not self.stopped.is_set():
+                try:
+                    self.results.put(res, not self.drop_oldest, .1)
+                    break
+                except queue.Full:
+                    if self.drop_oldest:
+                        self._discard()
+
+    def _discard(self):
+        try:
+            self.results.get_nowait()
+            self._skip()
+        except queue.Empty:
+            pass
+
+    def _skip(self):
+        with self.skipped_lock:
+            self.skipped += 1
+
+    def depth(self):
+        """ Number of results waiting to be consumed """
+        return self.results.qsize()
+
+    def next_result(self, timeout=None):
+        """ Block until the next result is ready and return it """
+        return self.results.get(timeout=timeout)
+
+    def drain(self):
+        """ Return every waiting result, oldest first. All but the newest
+            count as skipped, since only the newest gets plotted. """
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(len(results)-1):
+            self._skip()
+        return results
+
+    def latest(self):
+        """ Return the newest result, counting any older waiting results as
+            skipped, or None if nothing new has been computed. """
+        results = self.drain()
+        return results[-1] if results else None
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+""" Low allocation float32 version of the ExampleAlg pipeline.
+
+A Workspace owns every buffer needed to take one frame from samples to
+detections - the zero padded FFT input, the complex64 FFT output, the
+baseline and scratch space - allocated once and written in place on every
+frame. Results go into a small ring of fixed shape structured arrays, so a
+result stays valid while the next slots-1 frames are processed. The
+detection matches ExampleAlg._detect, apart from float32 rounding, without
+the channel means and variances.
+"""
+
+import numpy as np
+import framing
+import instrument
+import wavio
+try:
+    import bottleneck
+except ImportError:
+    bottleneck = None
+
+#Results kept before a slot is reused. Covers AlgWorker's default queue
+#depth, the result being drawn and the one being computed.
+SLOTS = 8
+#Value marking a detection in out, as in ExampleAlg
+DETECTION = 1E7
+
+
+def result_dtype(nchannels, nbins, max_peaks):
+    """ Structured dtype of one frame's result. Per peak fields have room
+        for max_peaks peaks, unused entries are -1 and False. chan_min is
+        also -1 where ExampleAlg's channel is not valid - too small, or of a
+        peak found again later - as in the store. """
+    return np.dtype([("frame_start", np.int64),
+                     ("spectrum", np.float32, (nchannels, nbins)),
+                     ("without_peaks", np.float32, (nchannels, nbins)),
+                     ("out", np.float32, (nchannels, nbins)),
+                     ("peaks", np.int32, (nchannels, max_peaks)),
+                     ("chan_min", np.int32, (nchannels, max_peaks)),
+                     ("detected", np.bool_, (nchannels, max_peaks))], align=True)
+
+
+class Workspace(object):
+    """ Preallocated buffers for one frame of nchannels channels at a time.
+        spectra() fills in the spectrum of the next slot, detect() the
+        rest. """
+    def __init__(self, nchannels, frame_len, fftlen, window="rect", max_peaks=15,
+                 max_width=31, slots=SLOTS):
+        nbins = fftlen//2
+        self.nchannels = nchannels
+        self.frame_len = frame_len
+        self.nbins = nbins
+        self.max_peaks = max_peaks
+        self.window_name = window
+        self.window = framing.get_window(window, frame_len).astype(np.float32)
+
+        self.results = np.zeros(slots, dtype=result_dtype(nchannels, nbins, max_peaks))
+        #Field views and plot channels of every slot, made once
+        self.fields = []
+        self.rows = []
+        for i in range(slots):
+            res = self.results[i, ...]
+            fields = dict((name, res[name]) for name in res.dtype.names)
+            self.fields.append(fields)
+            self.rows.append(list(fields["spectrum"]) + list(fields["without_peaks"]) +
+                             list(fields["out"]))
+        self.slot = -1
+
+        #Samples past frame_len stay zero, which pads frames to fftlen
+        self.frame = np.zeros((nchannels, max(frame_len, fftlen)), dtype=np.float32)
+        self.fft = np.zeros((nchannels, nbins+1), dtype=np.complex64)
+        self.floor = np.zeros((nchannels, nbins), dtype=np.float32)
+        self.padded = np.zeros((nchannels, nbins + 2*(max_width//2)), dtype=np.float32)
+        self.argmax = np.zeros(nchannels, dtype=np.intp)
+        self.mask = np.zeros(nbins, dtype=np.bool_)
+        #Timings are off unless ExampleAlg hands in its own profiler
+        self.profiler = instrument.Profiler()
+
+        #scipy is only imported once a workspace is made, so it stays off
+        #the startup path of the default mode
+        from scipy import ndimage
+        self.ndimage = ndimage
+        try:
+            #Transforms float32 in single precision, allocating only its output
+            from scipy import fft
+            self.fftpack = fft
+        except ImportError:
+            self.fftpack = None
+
+    def result(self):
+        """ Structured result of the latest frame """
+        return self.results[self.slot, ...]
+
+    def channels(self):
+        """ Rows of the latest frame's spectrum, without_peaks and out, in
+            the order of ExampleAlg.run() """
+        return self.rows[self.slot]
+
+    def spectra(self, samples, sampwidth, frame_start=None):
+        """ Scale, window and FFT a channels x samples frame into the
+            spectrum of the next slot. Short frames are zero padded. """
+        self.slot = (self.slot + 1) % len(self.results)
+        fields = self.fields[self.slot]
+        fields["frame_start"][...] = -1 if frame_start is None else frame_start
+
+        frame = self.frame
+        n = np.shape(samples)[-1]
+        wavio.scale_into(samples, sampwidth, frame[:, :n])
+        frame[:, n:self.frame_len] = 0
+        if self.window_name != "rect":
+            np.multiply(frame[:, :self.frame_len], self.window, out=frame[:, :self.frame_len])
+        fft_input = frame[:, :2*self.nbins]
+        if self.fftpack is not None:
+            #The transform's output is the other array allocated per frame.
+            #numpy's rfft with out= allocates a double precision work
+            #buffer four times the size.
+            np.abs(self.fftpack.rfft(fft_input, axis=-1)[:, :self.nbins], out=fields["spectrum"])
+            return fields["spectrum"]
+        self.fft[...] = np.fft.rfft(fft_input, axis=-1)
+        np.abs(self.fft[:, :self.nbins], out=fields["spectrum"])
+        return fields["spectrum"]
+
+    def _baseline(self, spectrum, width, method):
+        floor = self.floor
+        if method == "median":
+            if width <= 1:
+                np.copyto(floor, spectrum)
+            elif bottleneck is not None:
+                #move_median has no output argument, so this is the one
+                #array allocated per frame
+                half = width // 2
+                nbins = self.nbins
+                if self.padded.shape[1] < nbins + 2*half:
+                    self.padded = np.zeros((self.nchannels, nbins + 2*half), dtype=np.float32)
+                padded = self.padded[:, :nbins + 2*half]
+                padded[:, :half] = 0
+                padded[:, half:half+nbins] = spectrum
+                padded[:, half+nbins:] = 0
+                floor[...] = bottleneck.move_median(padded, width, axis=-1)[:, 2*half:]
+            else:
+                self.ndimage.median_filter(spectrum, size=(1, width), output=floor,
+                                      mode="constant", cval=0)
+        elif method == "min":
+            self.ndimage.minimum_filter1d(spectrum, width, axis=-1, output=floor,
+                                     mode="constant", cval=0)
+        elif method == "percentile":
+            self.ndimage.percentile_filter(spectrum, 25, size=(1, width), output=floor,
+                                      mode="constant", cval=0)
+        else:
+            raise ValueError("Unknown baseline " + str(method))
+        return floor
+
+    def detect(self, params, baseline_method="median", profiler=None):
+        """ Run ExampleAlg's detection on the spectrum of the latest slot,
+            with params by name. Stages are timed by profiler, if given.
+            Returns the slot's structured result. """
+        profiler = self.profiler if profiler is None else profiler
+        fields = self.fields[self.slot]
+        spectrum = fields["spectrum"]
+        without_peaks = fields["without_peaks"]
+        peaks = fields["peaks"]
+
+        med_filt_width = params["med_filt_width"]
+        med_filt_width = med_filt_width if med_filt_width % 2 == 1 else med_filt_width+1
+        half_width = params["peak_width_bins"] // 2
+        chan_width_bins = params["chan_width_bins"]
+        peak_count = min(params["peak_count"], self.max_peaks)
+
+        with profiler.stage("baseline"):
+            floor = self._baseline(spectrum, med_filt_width, baseline_method)
+            np.subtract(spectrum, floor, out=without_peaks)
+            np.abs(without_peaks, out=without_peaks)
+
+        with profiler.stage("peaks"):
+            self._suppressPeaks(without_peaks, peaks, peak_count, half_width)
+        with profiler.stage("chan_stats"):
+            self._channelStats(fields, peak_count, half_width, chan_width_bins,
+                               params["passband_start_bin"], params["passband_stop_bin"])
+        return self.result()
+
+    def _suppressPeaks(self, without_peaks, peaks, peak_count, half_width):
+        #Masked argmax, one slice of each row zeroed per peak
+        peaks.fill(-1)
+        for i in range(peak_count):
+            np.argmax(without_peaks, axis=1, out=self.argmax)
+            peaks[:, i] = self.argmax
+            for r in range(self.nchannels):
+                p = int(self.argmax[r])
+                without_peaks[r, max(p-half_width, 0):p+half_width+1] = 0
+
+    def _channelStats(self, fields, peak_count, half_width, chan_width_bins,
+                      passband_start, passband_stop):
+        without_peaks = fields["without_peaks"]
+        peaks = fields["peaks"]
+        chan_min = fields["chan_min"]
+        detected = fields["detected"]
+        out = fields["out"]
+        nbins = self.nbins
+
+        #Quietest bin of each channel, in peak order since the zero fill of
+        #one channel is seen by the channels after it
+        chan_min.fill(-1)
+        detected.fill(False)
+        out.fill(0)
+        mask = self.mask
+        for r in range(self.nchannels):
+            row = without_peaks[r]
+            for i in range(peak_count):
+                p = int(peaks[r, i])
+                lo = min(p+half_width, nbins)
+                hi = p+chan_width_bins-half_width
+                hi = min(max(hi+nbins if hi < 0 else hi, 0), nbins)
+                if hi - lo < 2:
+                    continue
+                chan = row[lo:hi]
+                zeros = mask[:hi-lo]
+                np.equal(chan, 0, out=zeros)
+                np.copyto(chan, 1E5, where=zeros)
+                local_min = int(chan[1:].argmin()) + 1
+                if chan[local_min] >= chan.max():
+                    local_min = 0
+                #A peak found again later only counts for its last channel
+                repeated = False
+                for j in range(i+1, peak_count):
+                    if peaks[r, j] == p:
+                        repeated = True
+                        break
+                if repeated:
+                    continue
+                chan_min[r, i] = p + local_min
+                if passband_start < chan_min[r, i] < passband_stop:
+                    detected[r, i] = True
+                    out[r, chan_min[r, i]] = DETECTION